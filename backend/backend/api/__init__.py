@@ -11,12 +11,16 @@ from fastapi_pagination import add_pagination
 
 from backend.api.apps.widget import widget_api
 from backend.api.exceptions import Detail, map_auth_exception_to_http
+from backend.api.rate_limit import rate_limiter
 from backend.api.routers.auth import router as auth_router
 from backend.api.routers.health import router as health_router
 from backend.api.routers.payments import router as payments_router
+from backend.api.routers.simplify.chat import conversation_store
 from backend.core.db import init_db
 from backend.core.settings import settings
 from backend.services.auth.exceptions import BackendException
+from backend.services.chat import prewarm_cache
+from backend.services.sites import shared_site_index, site_filter, site_registry, widget_sessions
 
 secure_headers = secure.Secure.from_preset(
     preset=secure.Preset.BASIC
@@ -26,7 +30,21 @@ secure_headers = secure.Secure.from_preset(
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    yield await init_db()
+    await init_db()
+    await conversation_store.start()
+    await rate_limiter.start()
+    await site_registry.start()
+    await shared_site_index.start()
+    await site_filter.start()
+    await widget_sessions.start()
+    yield
+    await widget_sessions.stop()
+    await site_filter.stop()
+    await shared_site_index.stop()
+    await site_registry.stop()
+    await prewarm_cache.stop()
+    await rate_limiter.stop()
+    await conversation_store.stop()
 
 
 app = FastAPI(lifespan=lifespan, root_path=settings.api_root_path)
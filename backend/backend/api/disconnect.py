@@ -0,0 +1,38 @@
+import asyncio
+from collections.abc import Awaitable
+
+from fastapi import HTTPException, Request
+
+from backend.utils.log import logger
+
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """Wait until the client disconnects. Only use it after the request body has been read."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect[T](request: Request, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable`, cancelling it when the client disconnects first."""
+    task = asyncio.ensure_future(awaitable)
+    disconnect = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        done, _ = await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnect.cancel()
+        # The client disconnected, or this request itself was cancelled.
+        if not task.done():
+            task.cancel()
+
+    if task in done:
+        return task.result()
+
+    # Let the task clean up (release its locks and slots) before answering.
+    await asyncio.wait({task})
+    logger.info(f"Client disconnected from {request.url.path}, cancelled the request")
+    # The client is gone, so nobody will see this response.
+    raise HTTPException(status_code=HTTP_499_CLIENT_CLOSED_REQUEST, detail="Client closed request")
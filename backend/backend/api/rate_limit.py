@@ -0,0 +1,53 @@
+from collections.abc import Awaitable, Callable
+
+from fastapi import HTTPException, Request, status
+
+from backend.core.settings import RateLimit, settings
+from backend.core.settings.enums import Environment
+from backend.services.rate_limit import RateLimitExceeded, create_rate_limiter
+
+rate_limiter = create_rate_limiter(settings.rate_limit)
+trusted_proxy_hops = (
+    settings.rate_limit.trusted_proxy_hops
+    if settings.rate_limit.trusted_proxy_hops is not None
+    else int(settings.environment != Environment.LOCAL)
+)
+
+
+def client_ip(request: Request) -> str | None:
+    """The ip of the client, as seen by the outermost trusted proxy."""
+    if trusted_proxy_hops > 0:
+        forwarded_for = request.headers.get("x-forwarded-for")
+        if forwarded_for:
+            addresses = [address.strip() for address in forwarded_for.split(",")]
+            return addresses[-min(trusted_proxy_hops, len(addresses))]
+    return request.client.host if request.client else None
+
+
+def site_id(request: Request) -> str | None:
+    return request.headers.get("x-site-id")
+
+
+def check_rate_limit(scope: str, key: str, limit: RateLimit) -> None:
+    """Count a request for the key, raising a 429 when it exceeds the limit."""
+    try:
+        rate_limiter.hit(scope, key, limit)
+    except RateLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, try again later.",
+            headers={"Retry-After": str(e.retry_after)},
+        ) from e
+
+
+def rate_limit(
+    scope: str, limit: RateLimit, key: Callable[[Request], str | None] = client_ip
+) -> Callable[[Request], Awaitable[None]]:
+    """Create a dependency that limits the rate of requests per key, requests without a key are not limited."""
+
+    async def dependency(request: Request) -> None:
+        value = key(request)
+        if value is not None:
+            check_rate_limit(scope, value, limit)
+
+    return dependency
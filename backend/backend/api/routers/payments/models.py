@@ -1,17 +1,7 @@
 from enum import Enum
 from typing import Literal
 
-from pydantic import BaseModel, SecretStr
-
-
-class PaymentProvider(BaseModel):
-    api_key: SecretStr
-    webhook_secret: SecretStr
-    environment: Literal["sandbox", "production"] = "production"
-    url_endpoint: str = "fix it"
-    plans_refresh_interval_hours: int = 24
-    default_plan_name: str | None = None
-    trial_period_days: int = 7
+from pydantic import BaseModel
 
 
 class PaymentEventType(Enum):
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from . import chat, profiles, website_overrides
+from . import batch, chat, profiles, website_overrides
 
 router = APIRouter(prefix="/simplify", tags=["simplify"])
 
@@ -8,5 +8,6 @@ router = APIRouter(prefix="/simplify", tags=["simplify"])
 router.include_router(profiles.router)
 router.include_router(website_overrides.router)
 router.include_router(chat.router)
+router.include_router(batch.router)
 
 __all__ = ["router"]
@@ -0,0 +1,87 @@
+import asyncio
+from collections.abc import AsyncIterator
+from uuid import uuid4
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
+
+from backend.api.routers.auth.dependencies import get_current_user
+from backend.core.settings import settings
+from backend.services.chat import admission, process_chat_message
+from backend.services.chat.admission import AdmissionRejected
+from backend.services.chat.models import ChatBatchItem, ChatBatchItemResult, ChatBatchRequest, ChatRequest
+from backend.services.chat.store import ConversationStore
+from backend.utils.log import logger
+
+from .chat import conversation_store, overloaded, to_chat_response
+
+router = APIRouter(prefix="/chat", dependencies=[Depends(get_current_user)])
+
+
+async def process_batch_item(
+    index: int, item: ChatBatchItem, persist: bool, semaphore: asyncio.Semaphore
+) -> ChatBatchItemResult:
+    """Process an item as the first message of a new conversation, reporting errors in the result."""
+    request = ChatRequest(conversation_id=uuid4(), message_id=uuid4(), message=item.content, config=item.config)
+    store = conversation_store if persist else ConversationStore(settings.chat.conversation_store)
+    conversation_id = request.conversation_id if persist else None
+    async with semaphore:
+        try:
+            latest_message = await process_chat_message(request, store)
+        except AdmissionRejected as e:
+            return ChatBatchItemResult(index=index, conversation_id=conversation_id, error=e.message)
+        except Exception as e:
+            logger.exception(f"Batch item {index} failed for conversation {request.conversation_id}: {e}")
+            return ChatBatchItemResult(
+                index=index, conversation_id=conversation_id, error="An unexpected error occurred."
+            )
+
+    return ChatBatchItemResult(
+        index=index,
+        conversation_id=conversation_id,
+        message=to_chat_response(request.conversation_id, latest_message).message,
+    )
+
+
+@router.post(
+    "/batch",
+    operation_id="chat_post_chat_batch",
+    summary="Chat Batch",
+    description=(
+        "Simplify a list of contents, each with its own config, as the first message of a new conversation, "
+        "which is only stored with `persist`. "
+        "Streams a `ChatBatchItemResult` per item as newline delimited JSON, in the order they complete."
+    ),
+    response_class=StreamingResponse,
+)
+async def chat_batch(request: ChatBatchRequest) -> StreamingResponse:
+    """
+    Chat Batch.
+
+    Items are processed concurrently, a failing item is reported in its result.
+    """
+    if len(request.items) > settings.chat.batch.max_items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can have at most {settings.chat.batch.max_items} items",
+        )
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        raise overloaded(e) from e
+
+    async def results() -> AsyncIterator[str]:
+        semaphore = asyncio.Semaphore(settings.chat.batch.max_parallel)
+        tasks = [
+            asyncio.create_task(process_batch_item(index, item, request.persist, semaphore))
+            for index, item in enumerate(request.items)
+        ]
+        try:
+            for result in asyncio.as_completed(tasks):
+                yield (await result).model_dump_json() + "\n"
+        finally:
+            # The client disconnected, stop processing the remaining items.
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
@@ -1,21 +1,90 @@
+import json
+from collections.abc import AsyncIterator
 from uuid import UUID
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from pydantic_ai.messages import ToolCallPart
 
-from backend.services.chat import process_chat_message
+from backend.api.disconnect import cancel_on_disconnect
+from backend.api.rate_limit import check_rate_limit, rate_limit, rate_limiter, site_id
+from backend.api.routers.auth.dependencies import get_current_user
+from backend.core.settings import settings
+from backend.services.chat import (
+    admission,
+    conversation_locks,
+    idempotency,
+    model_router,
+    near_duplicate_cache,
+    prewarm_cache,
+    process_chat_message,
+    response_cache,
+    segment_memory,
+    single_flight,
+    stream_chat_message,
+)
+from backend.services.chat.admission import AdmissionRejected
 from backend.services.chat.models import (
     ChatRequest,
     ChatResponse,
-    Conversation,
+    ChatStats,
+    ChatStreamDelta,
     FrontendMessage,
     StoredMessage,
 )
+from backend.services.chat.store import create_conversation_store
+from backend.services.content import content_cache
+from backend.utils.log import logger
 
 router = APIRouter(prefix="/chat")
 
-conversations_db: dict[UUID, Conversation] = {}
-messages_db: dict[UUID, list[StoredMessage]] = {}
+public_rate_limits = [
+    Depends(rate_limit("chat:ip", settings.chat.rate_limits.ip)),
+    Depends(rate_limit("chat:site", settings.chat.rate_limits.site, site_id)),
+]
+
+conversation_store = create_conversation_store(settings.chat.conversation_store)
+
+
+def to_chat_response(conversation_id: UUID, latest_message: StoredMessage) -> ChatResponse:
+    content = "".join(
+        [str(part.content) for part in latest_message.message.parts if not isinstance(part, ToolCallPart)]
+    )
+
+    frontend_message = FrontendMessage(
+        id=latest_message.id,
+        kind="response",
+        content=content,
+    )
+
+    return ChatResponse(
+        conversation_id=conversation_id,
+        message=frontend_message,
+    )
+
+
+async def resolve_content(request: ChatRequest) -> ChatRequest:
+    """Prepend the uploaded page content referred to by `content_hash` to the message."""
+    if request.content_hash is None:
+        return request
+
+    content = await content_cache.get(request.content_hash)
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown content_hash, upload the content")
+    return request.with_content(content.text)
+
+
+def overloaded(exception: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=exception.message,
+        headers={"Retry-After": str(exception.retry_after)},
+    )
+
+
+def format_sse(event: str, data: str) -> str:
+    """Format a single Server-Sent Event. `data` must not contain newlines (JSON encoded data never does)."""
+    return f"event: {event}\ndata: {data}\n\n"
 
 
 @router.post(
@@ -23,27 +92,88 @@ messages_db: dict[UUID, list[StoredMessage]] = {}
     operation_id="chat_post_chat_public",
     summary="Chat Public",
     description="Chat Public.",
+    dependencies=public_rate_limits,
 )
-async def chat_public(request: ChatRequest) -> ChatResponse:
+async def chat_public(request: ChatRequest, http_request: Request) -> ChatResponse:
     """
     Chat Public.
 
-    Without authentication.
-    # TODO: need to implement rate limit etc.
+    Without authentication, rate limited per client ip, site and conversation.
     """
-    latest_message = await process_chat_message(request, conversations_db, messages_db)
+    check_rate_limit("chat:conversation", str(request.conversation_id), settings.chat.rate_limits.conversation)
+    request = await resolve_content(request)
+    try:
+        latest_message = await cancel_on_disconnect(http_request, process_chat_message(request, conversation_store))
+    except AdmissionRejected as e:
+        raise overloaded(e) from e
+    return to_chat_response(request.conversation_id, latest_message)
 
-    content = "".join(
-        [str(part.content) for part in latest_message.message.parts if not isinstance(part, ToolCallPart)]
-    )
 
-    frontend_message = FrontendMessage(
-        id=latest_message.id,
-        kind="response",
-        content=content,
+@router.post(
+    "/public/stream",
+    operation_id="chat_post_chat_public_stream",
+    summary="Chat Public Stream",
+    description=(
+        "Chat Public, streamed as Server-Sent Events. Emits `delta` events with the text as it is generated, "
+        "followed by a single `message` event with the full `ChatResponse`, or an `error` event."
+    ),
+    response_class=StreamingResponse,
+    dependencies=public_rate_limits,
+)
+async def chat_public_stream(request: ChatRequest) -> StreamingResponse:
+    """
+    Chat Public Stream.
+
+    Without authentication, rate limited per client ip, site and conversation.
+    """
+    check_rate_limit("chat:conversation", str(request.conversation_id), settings.chat.rate_limits.conversation)
+    request = await resolve_content(request)
+    # Reject before the response starts when the worker is overloaded, afterwards it can only be an error event.
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        raise overloaded(e) from e
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for item in stream_chat_message(request, conversation_store):
+                if isinstance(item, StoredMessage):
+                    yield format_sse("message", to_chat_response(request.conversation_id, item).model_dump_json())
+                else:
+                    yield format_sse("delta", ChatStreamDelta(content=item).model_dump_json())
+        except AdmissionRejected as e:
+            yield format_sse("error", json.dumps({"detail": e.message}))
+        except Exception as e:
+            # The response has already started, so we can only report the error in the stream itself.
+            logger.exception(f"Streaming chat failed for conversation {request.conversation_id}: {e}")
+            yield format_sse("error", '{"detail": "An unexpected error occurred."}')
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
-    return ChatResponse(
-        conversation_id=request.conversation_id,
-        message=frontend_message,
+
+@router.get(
+    "/stats",
+    operation_id="chat_get_chat_stats",
+    summary="Chat Stats",
+    description="Occupancy, eviction and admission (queue depth, wait time) statistics of the chat service.",
+    dependencies=[Depends(get_current_user)],
+)
+async def chat_stats() -> ChatStats:
+    return ChatStats(
+        conversation_store=conversation_store.stats(),
+        response_cache=response_cache.stats(),
+        near_duplicates=near_duplicate_cache.stats(),
+        segments=segment_memory.stats(),
+        prewarm=prewarm_cache.stats(),
+        model_router=model_router.stats(),
+        single_flight=single_flight.stats(),
+        idempotency=idempotency.stats(),
+        conversation_locks=conversation_locks.stats(),
+        admission=admission.stats(),
+        rate_limit=rate_limiter.stats(),
+        content_cache=content_cache.stats(),
     )
@@ -1,47 +1,13 @@
 from datetime import datetime
-from enum import Enum
 from urllib.parse import urlparse
 
 from beanie import Document
 from pydantic import BaseModel, Field, field_validator
 
+from backend.services.chat.models import Config
 from backend.utils.helpers import basic_normalize
 
 
-class LearningStyle(str, Enum):
-    NO_PREFERENCE = "no preference"  # cannot just remove this, because in site override we already select null;
-    # how do we know if it's null or no preference?
-    VISUAL = "visual"  # create diagrams
-    # AUDIO = "audio"
-    ANALOGIES = "analogies"  # use analogies
-
-
-class FamiliarityLevel(str, Enum):
-    BEGINNER = "beginner"
-    INTERMEDIATE = "intermediate"
-    ADVANCED = "advanced"
-
-
-class Config(BaseModel):
-    familiarity: FamiliarityLevel | None = Field(None, description="The user's familiarity level with the topic.")
-    background: str | None = Field(None, description="The user's background or prior knowledge. ")
-    context: str | None = Field(None, description="Add specific context or scenario for the interaction.")
-    strict_adherence: bool | None = Field(
-        None, description="Whether the AI should strictly adhere to the provided page content."
-    )
-    summary: bool | None = Field(None, description="Whether a summary of the information is required.")
-    purpose: str | None = Field(None, description="The primary purpose or goal of the user's interaction.")
-    learning_style: LearningStyle | None = Field(None, description="The user's preferred learning style.")
-
-    @field_validator("background", "context", "purpose", mode="before")
-    @classmethod
-    def empty_str_to_none(cls, v: str | None) -> str | None:
-        """Replace empty string with None."""
-        if v == "":
-            return None
-        return v
-
-
 class ProfileIn(BaseModel):
     name: str = Field(..., description="Display name for the profile")
     config: Config
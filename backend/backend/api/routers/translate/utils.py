@@ -1,56 +1,55 @@
-from beanie import Document
-from cachetools import TTLCache  # type: ignore
 from fastapi import Header, HTTPException
 from pydantic import AnyUrl
 
 from backend.core.settings import settings
 from backend.core.settings.enums import Environment
+from backend.services.sites import Site, shared_site_index, site_cache, site_filter, site_registry, widget_sessions
 from backend.utils.log import logger
 
 
-class Site(Document):
-    """Site model for storing registered domains and their siteIds"""
-
-    domain: str  # example.com
-    site_id: str  # random uuid
-    owner_id: str | None = None  # tenant
-    active: bool = True
-
-    class Settings:
-        name = "sites"
-
-    @classmethod
-    async def find_by_domain_and_site_id(cls, domain: str, site_id: str) -> "Site | None":
-        """Find a site by domain and site_id"""
-        return await cls.find_one({"domain": domain, "site_id": site_id, "active": True})
-
-    @classmethod
-    async def is_valid(cls, domain: str, site_id: str) -> bool:
-        """Check if a domain and site_id combination is valid"""
-        site: Site | None = await cls.find_by_domain_and_site_id(domain, site_id)
-        return site is not None
+def request_origin(origin: str | None) -> str | None:
+    """The origin of the request, or the configured default origin in the local environment."""
+    # Allow localhost for development
+    if settings.environment == Environment.LOCAL:
+        logger.info("Local environment, skipping site verification")
+        return settings.widget.default_origin
+    return origin
 
 
-site_cache: TTLCache[str, Site] = TTLCache(maxsize=1000, ttl=3600)  # Cache up to 1000 mappings for 1 hour
+SITE_ID_HEADER = (
+    Header(..., description="Site identifier")
+    if settings.environment != Environment.LOCAL
+    else Header(settings.widget.default_x_site_id, description="Site identifier")
+)
 
 
 async def verify_site(
-    x_site_id: str = Header(..., description="Site identifier")
-    if settings.environment != Environment.LOCAL
-    else Header(settings.widget.default_x_site_id, description="Site identifier"),
+    x_site_id: str = SITE_ID_HEADER,
     origin: str | None = Header(None, description="Request origin"),
+    x_widget_session: str | None = Header(None, description="Widget session token, from `POST /widget/session`"),
 ) -> Site:
-    """Verify that the request is coming from a registered site"""
-    logger.info(f"Verifying site {x_site_id=} from {origin=}")
+    """Verify that the request is coming from a registered site, or has a session of one"""
+    # A valid session token proves that the site was verified before, for this origin.
+    if x_widget_session is not None and widget_sessions.enabled:
+        session_origin = request_origin(origin)
+        site = widget_sessions.verify(x_widget_session, x_site_id, session_origin) if session_origin else None
+        if site is not None:
+            return site
+
+    return await verify_registered_site(x_site_id, origin)
 
-    # Allow localhost for development
-    if settings.environment == Environment.LOCAL:
-        origin = settings.widget.default_origin
-        logger.info("Local environment, skipping site verification")
 
+async def verify_registered_site(
+    x_site_id: str = SITE_ID_HEADER,
+    origin: str | None = Header(None, description="Request origin"),
+) -> Site:
+    """Verify that the request is coming from a registered site, without accepting a session"""
+    origin = request_origin(origin)
     if not origin:
         raise HTTPException(status_code=403, detail="Invalid origin")
 
+    logger.info(f"Verifying site {x_site_id=} from {origin=}")
+
     origin_url = AnyUrl(origin)
     if not origin_url.host or "." not in origin_url.host:
         # does not contain a TLD, so people could do something like http://localhost which could have security issues.
@@ -59,18 +58,23 @@ async def verify_site(
     domain = origin_url.host
     logger.info(f"Found {domain=}/{x_site_id=}")
 
-    site = site_cache.get(x_site_id)
-    if site is None:
-        # not found in cache, retrieve from db
-        logger.info(f"Lookup {domain=}/{x_site_id=}")
-        site = await Site.find_by_domain_and_site_id(domain, x_site_id)
-        if not site:
-            logger.info(f"Lookup {domain=}/{x_site_id=}: Not found")
+    # All sites are known in memory, or in the index file shared by the workers.
+    index = site_registry if site_registry.ready else shared_site_index if shared_site_index.ready else None
+    if index is not None:
+        site = index.get(x_site_id, domain)
+        if site is not None:
+            return site
+        if index.watching:
+            logger.info(f"Lookup {domain=}/{x_site_id=}: Not in the site registry")
             raise HTTPException(status_code=403, detail="Invalid site_id or domain")
+        # The site may have been added after the last poll, unknown sites are cached by the lookup below.
+    if not site_filter.might_exist(x_site_id):
+        logger.info(f"Lookup {domain=}/{x_site_id=}: Known to not exist")
+        raise HTTPException(status_code=403, detail="Invalid site_id or domain")
 
-        site_cache[x_site_id] = site
-
-    if site.domain != domain:
+    site = await site_cache.get(x_site_id, domain)
+    if site is None:
+        logger.info(f"Lookup {domain=}/{x_site_id=}: Not found")
         raise HTTPException(status_code=403, detail="Invalid site_id or domain")
 
     return site
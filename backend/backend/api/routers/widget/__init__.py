@@ -1,10 +1,16 @@
 from fastapi import APIRouter
 
 from .config import router as config_router
+from .content import router as content_router
+from .prewarm import router as prewarm_router
+from .session import router as session_router
 
 router = APIRouter(prefix="/widget", tags=["widget"])
 
 # router.include_router(chat.router)
 router.include_router(config_router)
+router.include_router(content_router)
+router.include_router(prewarm_router)
+router.include_router(session_router)
 
 __all__ = ["router"]
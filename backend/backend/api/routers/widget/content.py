@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import AnyUrl
+
+from backend.api.routers.translate.utils import Site, verify_site
+from backend.services.content import InvalidContent, content_cache
+from backend.services.content.models import ContentInfo, ContentLookup, ContentUpload, ExtractedContent
+
+router = APIRouter(prefix="/content")
+
+
+def to_content_info(content: ExtractedContent) -> ContentInfo:
+    return ContentInfo(content_hash=content.content_hash, text_hash=content.text_hash, length=len(content.text))
+
+
+def verify_url(url: str, site: Site) -> None:
+    """The content must be of a page of the site."""
+    try:
+        host = AnyUrl(url).host
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid url") from e
+    if host != site.domain:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Url is not on the domain of the site")
+
+
+@router.post(
+    "/lookup",
+    operation_id="widget_post_content_lookup",
+    summary="Content Lookup",
+    description="Check if the content of a page is known by its hash. Returns 404 when it must be uploaded.",
+    responses={404: {"description": "Unknown content, upload it with `PUT /content`."}},
+)
+async def content_lookup(lookup: ContentLookup, site: Site = Depends(verify_site)) -> ContentInfo:
+    verify_url(lookup.url, site)
+    content = await content_cache.get(lookup.content_hash)
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown content, upload it")
+    return to_content_info(content)
+
+
+@router.put(
+    "",
+    operation_id="widget_put_content",
+    summary="Content Upload",
+    description=(
+        "Upload the content of a page. The readable text is extracted and cached by `content_hash`, "
+        "so chat requests can refer to it by hash instead of sending it."
+    ),
+)
+async def content_upload(upload: ContentUpload, site: Site = Depends(verify_site)) -> ContentInfo:
+    verify_url(upload.url, site)
+    try:
+        content = await content_cache.put(upload, site.site_id)
+    except InvalidContent as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
+    return to_content_info(content)
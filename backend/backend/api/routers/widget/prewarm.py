@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from backend.api.rate_limit import rate_limit, site_id
+from backend.api.routers.translate.utils import Site, verify_site
+from backend.core.settings import settings
+from backend.services.chat import prewarm
+from backend.services.chat.models import PrewarmRequest, PrewarmResponse
+from backend.services.content import content_cache
+
+router = APIRouter(prefix="/prewarm")
+
+
+@router.post(
+    "",
+    operation_id="widget_post_prewarm",
+    summary="Prewarm",
+    description=(
+        "Start simplifying uploaded page content for a config in the background, when the widget loads. A chat "
+        "request with the same `content_hash`, config and no message is then answered with the prewarmed response. "
+        "Prewarms are best effort: they are `skipped` under load, and dropped when not claimed in time."
+    ),
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={404: {"description": "Unknown content, upload it with `PUT /content`."}},
+    dependencies=[
+        Depends(rate_limit("prewarm:ip", settings.chat.rate_limits.ip)),
+        Depends(rate_limit("prewarm:site", settings.chat.rate_limits.site, site_id)),
+    ],
+)
+async def prewarm_content(request: PrewarmRequest, site: Site = Depends(verify_site)) -> PrewarmResponse:
+    content = await content_cache.get(request.content_hash)
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown content, upload it")
+    if content.site_id != site.site_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Content is not of the site")
+    return PrewarmResponse(status=prewarm(content.text, request.config))
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from backend.api.routers.translate.utils import Site, request_origin, verify_registered_site
+from backend.services.sites import widget_sessions
+from backend.services.sites.models import WidgetSession
+
+router = APIRouter(prefix="/session")
+
+
+@router.post(
+    "",
+    operation_id="widget_post_session",
+    summary="Session",
+    description=(
+        "Create a short-lived session for the verified site. Send the token in the `x-widget-session` header of "
+        "later widget requests, so the site is not verified again. Request a new session before it expires."
+    ),
+    responses={404: {"description": "Widget sessions are not enabled."}},
+)
+async def create_session(
+    # Not with a session token, so sessions cannot be renewed after the site was deactivated.
+    site: Site = Depends(verify_registered_site),
+    origin: str | None = Header(None, description="Request origin"),
+) -> WidgetSession:
+    if not widget_sessions.enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Widget sessions are not enabled")
+    # verify_registered_site rejects requests without an origin
+    return widget_sessions.issue(site, request_origin(origin) or "")
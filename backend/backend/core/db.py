@@ -2,6 +2,10 @@ from beanie import init_beanie  # type: ignore
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from backend.core.settings import settings
+from backend.services.chat.models import ConversationDocument, MessageDocument, SegmentDocument
+from backend.services.content.models import ContentDocument
+from backend.services.rate_limit.models import RateLimitCounterDocument
+from backend.services.sites.models import Site
 from backend.services.users.models import User
 from backend.services.users.subscription import Subscription
 
@@ -14,6 +18,15 @@ async def init_db():
     database = client[settings.db_name]  # type: ignore
     await init_beanie(
         database=database,
-        document_models=[User, Subscription],
+        document_models=[
+            User,
+            Subscription,
+            ConversationDocument,
+            MessageDocument,
+            SegmentDocument,
+            ContentDocument,
+            RateLimitCounterDocument,
+            Site,
+        ],
         allow_index_dropping=True,
     )
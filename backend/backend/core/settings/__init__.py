@@ -2,19 +2,27 @@ import os
 from pathlib import Path
 from typing import Literal
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, SecretStr, model_validator
 from pydantic_settings import (
     BaseSettings,
     PydanticBaseSettingsSource,
     SettingsConfigDict,
 )
 
-from backend.api.routers.payments.models import PaymentProvider
-
 from .aws.parameter_store import SSMParameterStoreSettingsSource
 from .enums import Environment, LogLevels
 
 
+class PaymentProvider(BaseModel):
+    api_key: SecretStr
+    webhook_secret: SecretStr
+    environment: Literal["sandbox", "production"] = "production"
+    url_endpoint: str = "fix it"
+    plans_refresh_interval_hours: int = 24
+    default_plan_name: str | None = None
+    trial_period_days: int = 7
+
+
 class AuthTokenCookieSettings(BaseModel):
     http_only: bool = True
     secure: bool = True
@@ -75,6 +83,182 @@ class Auth(BaseModel):
     cognito: AuthCognito
 
 
+class ConversationStoreSettings(BaseModel):
+    backend: Literal["memory", "mongodb"] = "memory"
+    max_conversations: int = 10_000
+    max_messages_per_conversation: int = 100
+    max_bytes: int = 256 * 1024 * 1024
+    idle_ttl_seconds: int = 24 * 3600
+    # only used by the mongodb backend
+    flush_interval_seconds: float = 1.0
+    flush_batch_size: int = 500
+    flush_max_attempts: int = 5  # failed flushes in a row before the unflushed writes are dropped
+    max_pending_messages: int = 50_000
+    persisted_ttl_seconds: int = 30 * 24 * 3600
+
+
+class AgentRegistrySettings(BaseModel):
+    max_agents: int = 256
+    max_pool_connections: int = 50
+
+
+class HistorySettings(BaseModel):
+    max_turns: int | None = 20
+    max_tokens: int | None = 16_000  # estimated
+    summarize: bool = True
+    summary_model: str | None = None  # defaults to the chat model
+    summary_max_load: float = 0.5  # fraction of the admission slots in use above which summaries are postponed
+
+
+class ResponseCacheSettings(BaseModel):
+    enabled: bool = False
+    max_entries: int = 10_000
+    ttl_seconds: int = 3600
+
+
+class ModelRouterSettings(BaseModel):
+    cheap_model: str | None = None  # for summaries of short input, e.g. "bedrock:eu.amazon.nova-micro-v1:0"
+    short_input_tokens: int = 2000
+    fallback_model: str | None = None  # hedge target, e.g. "bedrock:eu.anthropic.claude-3-haiku-20240307-v1:0"
+    hedge_after_seconds: float | None = None  # when not set, the p95 time to first token of the primary model is used
+    hedge_min_samples: int = 20  # latency samples needed before hedging on the p95
+    latency_samples: int = 200  # rolling window per model
+
+
+class ChunkingSettings(BaseModel):
+    enabled: bool = True
+    min_input_tokens: int = 8000  # first messages with more (estimated) tokens are simplified in chunks
+    chunk_tokens: int = 3000
+    max_parallel: int = 4  # chunks simplified at the same time, per request
+    reduce_model: str | None = None  # defaults to the model of the chunks
+
+
+class BatchSettings(BaseModel):
+    max_items: int = 100
+    max_parallel: int = 4  # items processed at the same time, per batch
+
+
+class IdempotencySettings(BaseModel):
+    max_entries: int = 10_000
+    ttl_seconds: int = 600  # how long the reply to a message_id is kept for retries
+
+
+class NearDuplicateSettings(BaseModel):
+    enabled: bool = False
+    max_entries: int = 10_000
+    ttl_seconds: int = 3600
+    max_distance: int = 3  # max number of differing SimHash bits (of 64) to count as a near-duplicate
+    shingle_size: int = 4  # words per shingle
+    min_words: int = 50  # shorter messages are only matched exactly
+
+
+class SegmentMemorySettings(BaseModel):
+    enabled: bool = False
+    backend: Literal["memory", "mongodb"] = "memory"  # mongodb shares the segments between workers and restarts
+    min_input_tokens: int = 1000  # first messages with more (estimated) tokens are simplified per segment
+    max_bytes: int = 64 * 1024 * 1024  # of simplified text in the in-process (hot) tier
+    persisted_ttl_seconds: int = 90 * 24 * 3600
+
+
+class PrewarmSettings(BaseModel):
+    enabled: bool = False
+    ttl_seconds: int = 120  # how long a prewarmed response waits to be claimed
+    max_entries: int = 1000
+    max_jobs: int = 16  # prewarms running at the same time
+    max_job_seconds: float = 60.0
+    max_load: float = 0.5  # fraction of the admission slots in use above which prewarms are not admitted
+
+
+class AdmissionSettings(BaseModel):
+    max_concurrency: int = 32  # model calls in flight per worker
+    max_queue: int = 64  # requests waiting for a slot, beyond that requests are rejected
+    max_queue_seconds: float = 10.0
+    retry_after_seconds: int = 2
+
+
+class RateLimit(BaseModel):
+    limit: int  # requests per window
+    window_seconds: int = 60
+
+
+class ChatRateLimits(BaseModel):
+    ip: RateLimit = RateLimit(limit=30)
+    site: RateLimit = RateLimit(limit=600)
+    conversation: RateLimit = RateLimit(limit=20)
+
+
+class RateLimitSettings(BaseModel):
+    enabled: bool = True
+    backend: Literal["memory", "mongodb"] = "memory"  # mongodb shares the counters between workers
+    max_keys: int = 100_000
+    flush_interval_seconds: float = 1.0  # how often the mongodb backend syncs the locally aggregated counters
+    # Proxies in front of the app that append the client ip to X-Forwarded-For. Defaults to 1 (the API gateway)
+    # outside the local environment, 0 means X-Forwarded-For is ignored.
+    trusted_proxy_hops: int | None = None
+
+
+class Chat(BaseModel):
+    model: str = "bedrock:eu.amazon.nova-lite-v1:0"
+    routing: ModelRouterSettings = ModelRouterSettings()
+    chunking: ChunkingSettings = ChunkingSettings()
+    segments: SegmentMemorySettings = SegmentMemorySettings()
+    batch: BatchSettings = BatchSettings()
+    conversation_store: ConversationStoreSettings = ConversationStoreSettings()
+    agents: AgentRegistrySettings = AgentRegistrySettings()
+    history: HistorySettings = HistorySettings()
+    response_cache: ResponseCacheSettings = ResponseCacheSettings()
+    near_duplicates: NearDuplicateSettings = NearDuplicateSettings()
+    prewarm: PrewarmSettings = PrewarmSettings()
+    single_flight: bool = True  # coalesce identical concurrent first-turn requests
+    idempotency: IdempotencySettings = IdempotencySettings()
+    admission: AdmissionSettings = AdmissionSettings()
+    rate_limits: ChatRateLimits = ChatRateLimits()
+
+
+class ContentCacheSettings(BaseModel):
+    # The chat request for uploaded content can reach another worker than the upload, so the memory backend only
+    # works with a single worker.
+    backend: Literal["memory", "mongodb"] = "mongodb"
+    max_bytes: int = 128 * 1024 * 1024  # of extracted text in the in-process (hot) tier
+    ttl_seconds: int = 24 * 3600
+    max_upload_bytes: int = 5 * 1024 * 1024
+
+
+class SiteVerificationSettings(BaseModel):
+    cache_ttl_seconds: int = 3600
+    cache_ttl_jitter: float = 0.2  # entries expire up to 20% earlier, so entries filled together expire spread out
+    cache_stale_seconds: int = 300  # an expired entry is served this long while it is refreshed in the background
+    cache_max_entries: int = 10_000
+    unknown_ttl_seconds: int = 60  # unknown site id/domain pairs are rejected without a lookup for this long
+    registry_enabled: bool = True  # keep all active sites in memory, so verifying known sites never hits the database
+    registry_refresh_seconds: float = 30.0  # poll interval for changes, when change streams are not available
+    # Also picks up deleted sites and changes without updated_at when polling. While polling, missing sites are
+    # looked up in the database (and cached), so only deactivations without updated_at wait for the reload.
+    registry_full_reload_seconds: float = 600.0
+    # Path of a memory-mapped index file shared by the workers of a host, only one of them loads and syncs the sites
+    registry_shared_file: str | None = None
+    registry_shared_check_seconds: float = 1.0  # how often the workers check if the file was replaced
+    # used when the registry is disabled, not loaded yet or polling for changes
+    filter_enabled: bool = True  # reject site ids that are not in a bloom filter of the active sites
+    filter_refresh_seconds: float = 60.0  # new sites are rejected until the next rebuild
+    filter_false_positive_rate: float = 0.01
+
+
+class WidgetSessionSettings(BaseModel):
+    secret: str | None = None  # HMAC key shared by all workers, widget sessions are disabled without it
+    ttl_seconds: int = 900
+    revocation_refresh_seconds: float = 30.0  # how fast tokens of deactivated sites are rejected
+
+
+class Widget(BaseModel):
+    # Used instead of the x-site-id and origin headers in the local environment, set them in .env
+    default_x_site_id: str | None = None
+    default_origin: str | None = None
+    content: ContentCacheSettings = ContentCacheSettings()
+    sites: SiteVerificationSettings = SiteVerificationSettings()
+    session: WidgetSessionSettings = WidgetSessionSettings()
+
+
 class Settings(BaseSettings):
     environment: Environment
     db_uri: str
@@ -87,10 +271,13 @@ class Settings(BaseSettings):
     db_connection_timeout: int = 5000
     api_root_path: str = "/api"
     widget_root_path: str = "/widget"
-    payments: "PaymentProvider"
+    payments: PaymentProvider
     mock_data: MockData = MockData()
     use_mock_data: bool = False
     auth: Auth
+    chat: Chat = Chat()
+    rate_limit: RateLimitSettings = RateLimitSettings()
+    widget: Widget = Widget()
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -138,7 +325,6 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     """Create and return settings from environment variables."""
     try:
-        Settings.model_rebuild()  # since we are using payments: "PaymentProvider" we need to rebuild
         return Settings()  # type: ignore  # some variables are expected to be set through .env
     except Exception as e:
         raise e
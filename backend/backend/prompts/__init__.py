@@ -1,42 +1,61 @@
+import json
+from pathlib import Path
 from typing import Any
 
-from jinja2 import StrictUndefined, Template
+from cachetools import LRUCache  # type: ignore
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, StrictUndefined, Template
 
-# from pydantic import BaseModel
+from backend.core.settings import settings
+from backend.core.settings.enums import Environment as AppEnvironment
+
+PROMPTS_DIR = Path(__file__).parent
+
+
+class PromptRegistry:
+    """Registry of the compiled prompt templates, which memoizes rendered templates."""
+
+    def __init__(self, auto_reload: bool = False, max_rendered: int = 1024):
+        self._environment = Environment(
+            loader=FileSystemLoader(PROMPTS_DIR),
+            undefined=StrictUndefined,
+            bytecode_cache=FileSystemBytecodeCache(),
+            auto_reload=auto_reload,
+        )
+        self._rendered: LRUCache[tuple[str, str], tuple[Template, str]] = LRUCache(maxsize=max_rendered)
+
+    def get(self, template_name: str) -> Template:
+        return self._environment.get_template(f"{template_name}.jinja2")
+
+    def render(self, template_name: str, vars: dict[str, Any]) -> str:
+        template = self.get(template_name)
+        key = (template_name, fingerprint_vars(vars))
+
+        cached = self._rendered.get(key)
+        # When the template was reloaded, the cached render is outdated.
+        if cached is not None and cached[0] is template:
+            return cached[1]
+
+        rendered = template.render(**vars)
+        self._rendered[key] = (template, rendered)
+        return rendered
+
+
+def fingerprint_vars(vars: dict[str, Any]) -> str:
+    """Canonical representation of the template variables, independent of the order of the keys."""
+    return json.dumps(vars, sort_keys=True, default=str)
+
+
+prompt_registry = PromptRegistry(auto_reload=settings.environment == AppEnvironment.LOCAL)
 
 
 def get_template(template_name: str, vars: dict[str, Any]) -> str:
     """Get and render a template with provided variables.
 
     Args:
-        template_name: Name of the template or path to template file
+        template_name: Name of the template, e.g. "main" for main.jinja2
         vars: Variables to use in the template rendering
 
     Returns:
         The rendered template as a string
     """
-    print(vars)
-    # Map template names to their full paths
-    template_map = {
-        "main": "backend/backend/prompts/main.jinja2",
-    }
-
-    # Get the full template path
-    template_path = template_map.get(template_name, template_name)
-
-    # Convert the model to a dictionary
-    # template_vars = vars.model_dump()
-
-    # Read and render the template
-    with open(template_path) as f:
-        template = Template(f.read(), undefined=StrictUndefined)
-
-    return template.render(**vars)
-
-
-# prompt = template.render(
-#     context="https://example.com",
-#     summary=True,
-#     expertise_level="advanced",
-#     additional_context="The user is interested in the technical aspects."
-# )
+    return prompt_registry.render(template_name, vars)
@@ -1,57 +1,334 @@
-from datetime import UTC, datetime
-from uuid import UUID, uuid4
+from collections.abc import AsyncIterator
+from itertools import pairwise
+from typing import Any
+from uuid import uuid4
 
 from pydantic_ai import Agent
+from pydantic_ai.agent import EventStreamHandler
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, TextPart, UserPromptPart
 
+from backend.core.settings import settings
 from backend.prompts import get_template
 from backend.utils.log import logger
 
-from .models import ChatRequest, Conversation, StoredMessage
+from .admission import AdmissionController
+from .agents import agent_registry
+from .cache import ResponseCache
+from .chunking import ChunkedSimplifier
+from .fingerprints import request_fingerprint
+from .history import HistoryPolicy
+from .idempotency import IdempotencyKey, IdempotencyTable
+from .locks import ConversationLocks
+from .model_router import ModelRouter
+from .models import ChatRequest, Config, Conversation, PrewarmStatus, StoredMessage
+from .near_duplicates import NearDuplicateCache
+from .prewarm import PrewarmCache
+from .segments import create_segment_memory
+from .singleflight import SingleFlight
+from .store import ConversationStore
 
+admission = AdmissionController(settings.chat.admission)
+history_policy = HistoryPolicy(
+    settings.chat.history,
+    settings.chat.model,
+    admission,
+    int(settings.chat.admission.max_concurrency * settings.chat.history.summary_max_load),
+)
+response_cache = ResponseCache(settings.chat.response_cache)
+near_duplicate_cache = NearDuplicateCache(settings.chat.near_duplicates)
+prewarm_cache = PrewarmCache(settings.chat.prewarm)
+single_flight: SingleFlight[list[ModelMessage]] = SingleFlight()
+idempotency = IdempotencyTable(settings.chat.idempotency)
+conversation_locks = ConversationLocks()
+model_router = ModelRouter(settings.chat.routing, settings.chat.model, admission)
+segment_memory = create_segment_memory(settings.chat.segments)
+chunked_simplifier = ChunkedSimplifier(settings.chat.chunking, model_router, admission, segment_memory)
 
-async def process_chat_message(
+
+def _prepare_conversation(
     request: ChatRequest,
-    conversations_db: dict[UUID, Conversation],
-    messages_db: dict[UUID, list[StoredMessage]],
-) -> StoredMessage:
+    conversation: Conversation | None,
+    store: ConversationStore,
+) -> tuple[Conversation, str | None, list[ModelMessage]]:
+    """Create or update the loaded conversation and return it with the instructions and history for the agent."""
     conversation_id = request.conversation_id
     instructions = None
-    conversation = conversations_db.get(conversation_id)
 
     if not conversation:
         # On the first message, create the conversation and add the system prompt.
-        conversations_db[conversation_id] = Conversation(conversation_id=conversation_id, config=request.config)
+        conversation = Conversation(conversation_id=conversation_id, config=request.config)
+        store.create(conversation)
         instructions = get_template("main", request.config.model_dump())
-        messages_db[conversation_id] = []
-    elif conversation.config != request.config:
+    elif conversation.config != request.config or conversation.message_count == 0:
         # When the config changes during the conversation, update the conversation and load the new template.
-        conversation.config = request.config
+        # Also when the first message failed before, because then the system prompt was never stored.
+        store.update_config(conversation, request.config)
         instructions = get_template("main", request.config.model_dump())
 
-    # Extract the history of ModelMessage objects for the agent.
-    message_history = [stored.message for stored in messages_db.get(conversation_id, [])]
+    # Extract the (windowed) history of ModelMessage objects for the agent.
+    message_history = history_policy.window(conversation, store.get_messages(conversation_id), store)
 
-    chat_agent = Agent(
-        "bedrock:eu.amazon.nova-lite-v1:0",
-        instructions=instructions,
-        # "bedrock:eu.anthropic.claude-3-haiku-20240307-v1:0",
-    )
+    return conversation, instructions, message_history
 
-    ai_response = await chat_agent.run(
-        user_prompt=request.message,
-        message_history=message_history,
-    )
 
-    new_messages = ai_response.new_messages()
+def _store_messages(
+    request: ChatRequest,
+    conversation: Conversation,
+    new_messages: list[ModelMessage],
+    store: ConversationStore,
+) -> StoredMessage:
+    """Store the user/AI message pair of a finished agent run and return the AI message."""
     if len(new_messages) != 2:
         logger.error(f"Agent returned unexpected number of messages: {len(new_messages)}. Expected 2.")
-        raise ValueError("Agent returned unexpected number of messages: {len(new_messages)}. Expected 2.")
+        raise ValueError(f"Agent returned unexpected number of messages: {len(new_messages)}. Expected 2.")
 
     user_message, ai_message = new_messages
-    messages_db[conversation_id].append(StoredMessage(id=request.message_id, message=user_message))
     latest_message = StoredMessage(id=uuid4(), message=ai_message)
-    messages_db[conversation_id].append(latest_message)
+    store.append_messages(
+        conversation,
+        [StoredMessage(id=request.message_id, message=user_message), latest_message],
+    )
+
+    return latest_message
+
+
+def _create_agent(model_name: str, instructions: str | None) -> Agent:
+    return agent_registry.get(model_name, instructions)
+
+
+def _user_message(request: ChatRequest, instructions: str | None) -> ModelRequest:
+    return ModelRequest(parts=[UserPromptPart(content=request.message)], instructions=instructions)
+
+
+def _response_text(message: ModelMessage) -> str:
+    return "".join(part.content for part in message.parts if isinstance(part, TextPart))
+
+
+def _get_cached_messages(
+    request: ChatRequest, instructions: str | None, message_history: list[ModelMessage]
+) -> list[ModelMessage] | None:
+    """Return the cached user/AI message pair of a first-turn message, or of near-identical content."""
+    if message_history:
+        return None
+
+    model_name = model_router.select(request, [])
+    ai_message = None
+    if response_cache.enabled:
+        ai_message = response_cache.get(model_name, request.message, request.config)
+    if ai_message is None and near_duplicate_cache.enabled:
+        ai_message = near_duplicate_cache.get(model_name, request)
+    if ai_message is None:
+        return None
+
+    return [_user_message(request, instructions), ai_message]
+
+
+def _cache_messages(
+    request: ChatRequest, message_history: list[ModelMessage], new_messages: list[ModelMessage]
+) -> None:
+    if message_history:
+        return
+
+    ai_message = new_messages[-1]
+    if isinstance(ai_message, ModelResponse):
+        model_name = model_router.select(request, [])
+        if response_cache.enabled:
+            response_cache.put(model_name, request.message, request.config, ai_message)
+        if near_duplicate_cache.enabled:
+            near_duplicate_cache.put(model_name, request, ai_message)
+
+
+async def _run_agent(
+    request: ChatRequest, instructions: str | None, message_history: list[ModelMessage]
+) -> list[ModelMessage]:
+    if chunked_simplifier.applies(request, message_history):
+        return await chunked_simplifier.run(request, instructions)
+
+    async def run(model_name: str, event_stream_handler: EventStreamHandler[Any]) -> list[ModelMessage]:
+        ai_response = await _create_agent(model_name, instructions).run(
+            user_prompt=request.message,
+            message_history=message_history,
+            event_stream_handler=event_stream_handler,
+        )
+        return ai_response.new_messages()
+
+    # A hedge takes a slot of its own.
+    async with admission.slot():
+        return await model_router.run(model_router.select(request, message_history), run)
+
+
+def _can_coalesce(message_history: list[ModelMessage]) -> bool:
+    return settings.chat.single_flight and not message_history
+
+
+async def _generate_messages(
+    request: ChatRequest, instructions: str | None, message_history: list[ModelMessage]
+) -> list[ModelMessage]:
+    """Run the agent, sharing one model call between identical first-turn requests, or claim a prewarm."""
+    if not message_history and prewarm_cache.enabled:
+        prewarmed = await prewarm_cache.claim(request_fingerprint(request.message, request.config))
+        if prewarmed is not None:
+            return [_user_message(request, instructions), prewarmed]
+
+    if not _can_coalesce(message_history):
+        return await _run_agent(request, instructions, message_history)
+
+    new_messages = await single_flight.do(
+        request_fingerprint(request.message, request.config),
+        lambda: _run_agent(request, instructions, message_history),
+    )
+    # The user message of the shared call belongs to one of the requests, so create our own.
+    return [_user_message(request, instructions), new_messages[-1]]
+
 
-    conversations_db[conversation_id].last_message_at = datetime.now(UTC)
+def _idempotency_key(request: ChatRequest) -> IdempotencyKey:
+    return (request.conversation_id, request.message_id)
 
+
+def _find_reply(
+    request: ChatRequest, conversation: Conversation | None, store: ConversationStore
+) -> StoredMessage | None:
+    """Find the stored AI reply to a retried message in the loaded conversation."""
+    if conversation is None:
+        return None
+
+    for message, reply in pairwise(store.get_messages(request.conversation_id)):
+        if message.id == request.message_id:
+            return reply
+    return None
+
+
+async def process_chat_message(
+    request: ChatRequest,
+    store: ConversationStore,
+) -> StoredMessage:
+    """Process a chat message once per `message_id` and return the stored AI reply."""
+    key = _idempotency_key(request)
+    reply = await idempotency.acquire(key)
+    if reply is not None:
+        return reply
+
+    try:
+        async with conversation_locks.hold(request.conversation_id):
+            # The conversation is loaded once, for both the retry check and the turn.
+            conversation = await store.load(request.conversation_id)
+            reply = _find_reply(request, conversation, store) or await _process_chat_message(
+                request, conversation, store
+            )
+    finally:
+        idempotency.release(key, reply)
+    return reply
+
+
+async def _process_chat_message(
+    request: ChatRequest,
+    conversation: Conversation | None,
+    store: ConversationStore,
+) -> StoredMessage:
+    conversation, instructions, message_history = _prepare_conversation(request, conversation, store)
+
+    cached_messages = _get_cached_messages(request, instructions, message_history)
+    if cached_messages is not None:
+        return _store_messages(request, conversation, cached_messages, store)
+
+    new_messages = await _generate_messages(request, instructions, message_history)
+
+    latest_message = _store_messages(request, conversation, new_messages, store)
+    _cache_messages(request, message_history, new_messages)
     return latest_message
+
+
+async def stream_chat_message(
+    request: ChatRequest,
+    store: ConversationStore,
+) -> AsyncIterator[str | StoredMessage]:
+    """Stream the text deltas of the AI response, followed by the stored AI message."""
+    key = _idempotency_key(request)
+    reply = await idempotency.acquire(key)
+    if reply is None:
+        try:
+            async with conversation_locks.hold(request.conversation_id):
+                conversation = await store.load(request.conversation_id)
+                reply = _find_reply(request, conversation, store)
+                if reply is None:
+                    async for item in _stream_chat_message(request, conversation, store):
+                        if isinstance(item, StoredMessage):
+                            reply = item
+                        yield item
+                    return
+        finally:
+            idempotency.release(key, reply)
+
+    yield _response_text(reply.message)
+    yield reply
+
+
+async def _stream_chat_message(
+    request: ChatRequest,
+    conversation: Conversation | None,
+    store: ConversationStore,
+) -> AsyncIterator[str | StoredMessage]:
+    conversation, instructions, message_history = _prepare_conversation(request, conversation, store)
+
+    cached_messages = _get_cached_messages(request, instructions, message_history)
+    if cached_messages is not None:
+        yield _response_text(cached_messages[-1])
+        yield _store_messages(request, conversation, cached_messages, store)
+        return
+
+    key = request_fingerprint(request.message, request.config)
+    if (
+        chunked_simplifier.applies(request, message_history)
+        or (_can_coalesce(message_history) and single_flight.in_flight(key))
+        or (not message_history and prewarm_cache.pending(key))
+    ):
+        # Long content is simplified in chunks, which cannot be streamed. And when an identical request is already
+        # being generated or was prewarmed, wait for it instead of streaming our own.
+        new_messages = await _generate_messages(request, instructions, message_history)
+        yield _response_text(new_messages[-1])
+        yield _store_messages(request, conversation, new_messages, store)
+        return
+
+    # A partially streamed response cannot be swapped for another one, so streams are not hedged.
+    chat_agent = _create_agent(model_router.select(request, message_history), instructions)
+
+    async with (
+        admission.slot(),
+        chat_agent.run_stream(
+            user_prompt=request.message,
+            message_history=message_history,
+        ) as ai_response,
+    ):
+        async for delta in ai_response.stream_text(delta=True):
+            yield delta
+
+    latest_message = _store_messages(request, conversation, ai_response.new_messages(), store)
+    _cache_messages(request, message_history, ai_response.new_messages())
+    yield latest_message
+
+
+def prewarm(message: str, config: Config) -> PrewarmStatus:
+    """Start simplifying a first message in the background, in a preemptible admission slot."""
+    request = ChatRequest(conversation_id=uuid4(), message_id=uuid4(), message=message, config=config)
+    if not prewarm_cache.enabled or chunked_simplifier.applies(request, []):
+        return prewarm_cache.skip()
+    return prewarm_cache.start(request_fingerprint(message, config), lambda: _prewarm(request))
+
+
+async def _prewarm(request: ChatRequest) -> ModelResponse:
+    instructions = get_template("main", request.config.model_dump())
+
+    async def run(model_name: str, event_stream_handler: EventStreamHandler[Any]) -> list[ModelMessage]:
+        ai_response = await _create_agent(model_name, instructions).run(
+            user_prompt=request.message, event_stream_handler=event_stream_handler
+        )
+        return ai_response.new_messages()
+
+    max_active = int(settings.chat.admission.max_concurrency * settings.chat.prewarm.max_load)
+    async with admission.preemptible_slot(max_active):
+        new_messages = await model_router.run(model_router.select(request, []), run, hedge=False)
+
+    ai_message = new_messages[-1]
+    if not isinstance(ai_message, ModelResponse):
+        raise ValueError("Agent did not end with a model response")
+    return ai_message
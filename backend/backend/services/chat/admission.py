@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from backend.utils.log import logger
+
+from .models import AdmissionStats
+from .waits import WaitTimes
+
+if TYPE_CHECKING:
+    from backend.core.settings import AdmissionSettings
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted, because the queue is full or the request waited too long."""
+
+    def __init__(self, message: str, retry_after: int):
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class AdmissionController:
+    """Bounds the number of concurrent model calls of this worker, queueing or rejecting the rest."""
+
+    def __init__(self, settings: "AdmissionSettings"):
+        self._settings = settings
+        self._active = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._cancelled = 0
+        self._preemptible: list[asyncio.Task[object]] = []  # in the order they were admitted
+        self._preempted = 0
+        self._waits = WaitTimes()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot for a model call, waiting in the queue if needed. Raises `AdmissionRejected` on overload."""
+        await self._acquire()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            raise
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def preemptible_slot(self, max_active: int) -> AsyncIterator[None]:
+        """Hold a slot for a low priority call, which is cancelled when a regular call needs it."""
+        task = asyncio.current_task()
+        if task is None:
+            raise RuntimeError("A preemptible slot can only be held by a task")
+        if self._waiters or self._active >= min(max_active, self._settings.max_concurrency):
+            raise AdmissionRejected("The service is busy, try again later.", self._settings.retry_after_seconds)
+
+        self._active += 1
+        self._preemptible.append(task)
+        try:
+            yield
+        finally:
+            if task in self._preemptible:
+                self._preemptible.remove(task)
+            self._release()
+
+    def available(self) -> bool:
+        """Whether a slot is free, so a new call would be admitted without waiting."""
+        return self._active < self._settings.max_concurrency and not self._waiters
+
+    def check(self) -> None:
+        """Raise `AdmissionRejected` when a new request would be rejected right away, without taking a slot."""
+        if len(self._waiters) >= self._settings.max_queue:
+            self._reject()
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(
+            active=self._active,
+            queued=len(self._waiters),
+            max_concurrency=self._settings.max_concurrency,
+            max_queue=self._settings.max_queue,
+            admitted=self._admitted,
+            rejected=self._rejected,
+            timed_out=self._timed_out,
+            cancelled=self._cancelled,
+            preempted=self._preempted,
+            wait_seconds_avg=self._waits.average(),
+            wait_seconds_max=self._waits.max(),
+        )
+
+    async def _acquire(self) -> None:
+        if self.available():
+            self._active += 1
+            self._admitted += 1
+            self._waits.add(0.0)
+            return
+
+        if len(self._waiters) >= self._settings.max_queue:
+            self._reject()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._preemptible:
+            # Cancel the newest low priority call, which has done the least work. Its slot is handed over to the
+            # first waiter when it is released.
+            self._preemptible.pop().cancel()
+            self._preempted += 1
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(self._settings.max_queue_seconds):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the timeout or cancellation, so pass it on.
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, TimeoutError):
+                self._timed_out += 1
+                raise AdmissionRejected(
+                    "The service is overloaded, try again later.", self._settings.retry_after_seconds
+                ) from e
+            raise
+
+        self._admitted += 1
+        self._waits.add(time.monotonic() - start)
+
+    def _reject(self) -> None:
+        self._rejected += 1
+        logger.warning(f"Chat admission queue is full ({len(self._waiters)} waiting), rejecting request")
+        raise AdmissionRejected("The service is overloaded, try again later.", self._settings.retry_after_seconds)
+
+    def _release(self) -> None:
+        # Hand the slot over to the first waiter, so it cannot be taken by a request that did not queue.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import boto3
+from botocore.config import Config as BotocoreConfig
+from pydantic_ai import Agent
+from pydantic_ai.models import Model, infer_model
+from pydantic_ai.models.bedrock import BedrockConverseModel
+from pydantic_ai.providers.bedrock import BedrockProvider
+
+from backend.core.settings import settings
+
+from .fingerprints import fingerprint
+
+if TYPE_CHECKING:
+    from backend.core.settings import AgentRegistrySettings
+
+BEDROCK_PREFIX = "bedrock:"
+
+
+class AgentRegistry:
+    """Process-wide LRU registry of agents and models, keyed by model name and instructions."""
+
+    def __init__(self, settings: "AgentRegistrySettings"):
+        self._settings = settings
+        self._agents: OrderedDict[tuple[str, str], Agent] = OrderedDict()
+        self._models: dict[str, Model] = {}
+        self._provider: BedrockProvider | None = None
+        # Agents are created synchronously on the event loop, the lock also makes it safe to use from threads.
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def get(self, model_name: str, instructions: str | None) -> Agent:
+        """Get the agent for the model and instructions, creating it if needed."""
+        key = (model_name, fingerprint(instructions))
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                return agent
+
+            agent = Agent(self._get_model(model_name), instructions=instructions)
+            self._agents[key] = agent
+            while len(self._agents) > self._settings.max_agents:
+                self._agents.popitem(last=False)
+            return agent
+
+    def get_model(self, model_name: str) -> Model:
+        with self._lock:
+            return self._get_model(model_name)
+
+    def _get_model(self, model_name: str) -> Model:
+        model = self._models.get(model_name)
+        if model is None:
+            if model_name.startswith(BEDROCK_PREFIX):
+                model = BedrockConverseModel(model_name.removeprefix(BEDROCK_PREFIX), provider=self._get_provider())
+            else:
+                model = infer_model(model_name)
+            self._models[model_name] = model
+        return model
+
+    def _get_provider(self) -> BedrockProvider:
+        if self._provider is None:
+            client = boto3.client(
+                "bedrock-runtime",
+                config=BotocoreConfig(max_pool_connections=self._settings.max_pool_connections),
+            )
+            self._provider = BedrockProvider(bedrock_client=client)
+        return self._provider
+
+
+agent_registry = AgentRegistry(settings.chat.agents)
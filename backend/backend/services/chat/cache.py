@@ -0,0 +1,49 @@
+from copy import deepcopy
+from typing import TYPE_CHECKING
+
+from cachetools import TTLCache  # type: ignore
+from pydantic_ai.messages import ModelResponse
+
+from .fingerprints import request_fingerprint
+from .models import Config, ResponseCacheStats
+
+if TYPE_CHECKING:
+    from backend.core.settings import ResponseCacheSettings
+
+
+class ResponseCache:
+    """Exact-match cache of AI responses to first-turn chat messages."""
+
+    def __init__(self, settings: "ResponseCacheSettings"):
+        self._settings = settings
+        self._cache: TTLCache[str, ModelResponse] = TTLCache(maxsize=settings.max_entries, ttl=settings.ttl_seconds)
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._settings.enabled
+
+    def get(self, model_name: str, message: str, config: Config) -> ModelResponse | None:
+        response = self._cache.get(_key(model_name, message, config))
+        if response is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return deepcopy(response)
+
+    def put(self, model_name: str, message: str, config: Config, response: ModelResponse) -> None:
+        self._cache[_key(model_name, message, config)] = deepcopy(response)
+
+    def stats(self) -> ResponseCacheStats:
+        return ResponseCacheStats(
+            enabled=self._settings.enabled,
+            entries=len(self._cache),
+            max_entries=self._settings.max_entries,
+            hits=self._hits,
+            misses=self._misses,
+        )
+
+
+def _key(model_name: str, message: str, config: Config) -> str:
+    return f"{model_name}\n{request_fingerprint(message, config)}"
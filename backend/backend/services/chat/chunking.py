@@ -0,0 +1,222 @@
+import asyncio
+import re
+from collections.abc import Awaitable, Callable
+from dataclasses import replace
+from typing import TYPE_CHECKING, Any
+
+from pydantic_ai import ModelRetry, UnexpectedModelBehavior
+from pydantic_ai.agent import EventStreamHandler
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, TextPart, UserPromptPart
+
+from backend.prompts import get_template
+from backend.utils.log import logger
+
+from .admission import AdmissionController, AdmissionRejected
+from .agents import agent_registry
+from .fingerprints import config_fingerprint
+from .history import CHARS_PER_TOKEN
+from .model_router import ModelRouter
+from .models import ChatRequest
+from .segments import SegmentMemory, segment_key
+
+if TYPE_CHECKING:
+    from backend.core.settings import ChunkingSettings
+
+BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+# More segments per model call make it more likely that the model merges or skips one.
+MAX_SEGMENTS_PER_CALL = 40
+HEADING = re.compile(r"^(#{1,6}\s|[A-Z0-9][^\n]{0,80}\n[=-]{3,}\s*$)")
+
+
+def _split_block(block: str, max_chars: int) -> list[str]:
+    """Split a block that is too large on sentences, and sentences that are too large on characters."""
+    parts: list[str] = []
+    current = ""
+    for sentence in SENTENCE_END.split(block):
+        while len(sentence) > max_chars:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            parts.append(current)
+            current = ""
+        current = f"{current} {sentence}" if current else sentence
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_segments(content: str, max_chars: int) -> list[str]:
+    """Split content into its blocks (paragraphs, headings, list items), blocks that are too large on sentences."""
+    segments: list[str] = []
+    for block in BLOCK_SEPARATOR.split(content.strip()):
+        block = block.strip()
+        if block:
+            segments.extend([block] if len(block) <= max_chars else _split_block(block, max_chars))
+    return segments
+
+
+def split_content(content: str, max_chars: int) -> list[str]:
+    """Split content into chunks of at most `max_chars`, preferably before headings."""
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for piece in split_segments(content, max_chars):
+        # Start a new chunk when the piece does not fit, or at a heading once the chunk is half full.
+        if current and (size + len(piece) > max_chars or (HEADING.match(piece) and size >= max_chars // 2)):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class ChunkedSimplifier:
+    """Simplifies long content in concurrent chunks, or per segment with the segment memory."""
+
+    def __init__(
+        self,
+        settings: "ChunkingSettings",
+        model_router: ModelRouter,
+        admission: AdmissionController,
+        segment_memory: SegmentMemory,
+    ):
+        self._settings = settings
+        self._model_router = model_router
+        self._admission = admission
+        self._segment_memory = segment_memory
+
+    def applies(self, request: ChatRequest, message_history: list[ModelMessage]) -> bool:
+        """Only first messages are chunked, follow-up questions are answered with the conversation as context."""
+        if message_history:
+            return False
+        input_tokens = len(request.message) // CHARS_PER_TOKEN
+        return (
+            self._settings.enabled and input_tokens > self._settings.min_input_tokens
+        ) or self._segment_memory.applies(input_tokens)
+
+    async def run(self, request: ChatRequest, instructions: str | None) -> list[ModelMessage]:
+        """Simplify the content in chunks and return the user/AI message pair."""
+        model_name = self._model_router.select(request, [])
+        semaphore = asyncio.Semaphore(self._settings.max_parallel)
+
+        async def call[T](prompt: str, call_instructions: str | None, output_type: Callable[..., T]) -> T:
+            async def run(name: str, event_stream_handler: EventStreamHandler[Any]) -> T:
+                result = await agent_registry.get(name, call_instructions).run(
+                    prompt, output_type=output_type, event_stream_handler=event_stream_handler
+                )
+                return result.output
+
+            async with semaphore, self._admission.slot():
+                return await self._model_router.run(model_name, run)
+
+        per_segment = self._segment_memory.applies(len(request.message) // CHARS_PER_TOKEN)
+        try:
+            if per_segment:
+                chunks = await self._simplify_segments(request, call)
+            else:
+                chunks = await self._simplify_chunks(request, instructions, call)
+        except ExceptionGroup as e:
+            # Raise a single error like an unchunked request, so an overload is still reported as such.
+            errors = e.exceptions
+            raise next((error for error in errors if isinstance(error, AdmissionRejected)), errors[0]) from None
+
+        document = "\n\n".join(chunks)
+        if per_segment and request.question is None:
+            # The segments are the answer, a page of known segments takes no model call at all.
+            response = ModelResponse(parts=[], model_name=model_name)
+        else:
+            response = await self._reduce(request, model_name, document)
+        answer = f"{response.text}\n\n{document}" if response.text else document
+
+        # Store the original message with the instructions of the conversation, and the combined answer.
+        user_message = ModelRequest(parts=[UserPromptPart(content=request.message)], instructions=instructions)
+        return [user_message, replace(response, parts=[TextPart(content=answer)])]
+
+    async def _reduce(self, request: ChatRequest, model_name: str, document: str) -> ModelResponse:
+        """Write a short introduction of the simplified document, or the answer to the question about it."""
+        template_vars = request.config.model_dump() | {"question": request.question is not None}
+        agent = agent_registry.get(self._settings.reduce_model or model_name, get_template("reduce", template_vars))
+        prompt = f"Simplified document:\n\n{document}"
+        if request.question is not None:
+            prompt += f"\n\nQuestion of the user:\n{request.question}"
+        async with self._admission.slot():
+            result = await agent.run(prompt)
+        return result.response
+
+    async def _simplify_chunks(self, request: ChatRequest, instructions: str | None, call: "_Call") -> list[str]:
+        chunks = split_content(request.content, self._settings.chunk_tokens * CHARS_PER_TOKEN)
+        logger.info(f"Simplifying {len(request.content)} characters in {len(chunks)} chunks")
+
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(
+                    call(f"Part {index + 1} of {len(chunks)} of the content:\n\n{chunk}", instructions, str)
+                )
+                for index, chunk in enumerate(chunks)
+            ]
+        return [task.result() for task in tasks]
+
+    async def _simplify_segments(self, request: ChatRequest, call: "_Call") -> list[str]:
+        """Simplify the unknown segments, and return the simplified segments in the order of the content."""
+        max_chars = self._settings.chunk_tokens * CHARS_PER_TOKEN
+        segments = split_segments(request.content, max_chars)
+        config_key = config_fingerprint(request.config)
+        keys = [segment_key(segment, config_key) for segment in segments]
+        known = await self._segment_memory.get_many(keys)
+        unknown = {key: segment for key, segment in zip(keys, segments, strict=True) if key not in known}
+        logger.info(f"Simplifying {len(unknown)} of {len(segments)} segments, the others are known")
+
+        instructions = get_template("segments", request.config.model_dump())
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(self._simplify_batch(batch, instructions, call))
+                for batch in _batches(list(unknown.items()), max_chars)
+            ]
+        simplified: dict[str, str] = {}
+        for task in tasks:
+            simplified |= task.result()
+        await self._segment_memory.put_many(simplified)
+
+        texts = known | simplified
+        return [texts[key] for key in keys]
+
+    async def _simplify_batch(self, batch: list[tuple[str, str]], instructions: str, call: "_Call") -> dict[str, str]:
+        def simplified_segments(segments: list[str]) -> list[str]:
+            """The simplified segments, one per segment, in the same order."""
+            if len(segments) != len(batch):
+                raise ModelRetry(f"Return exactly {len(batch)} simplified segments, not {len(segments)}.")
+            return segments
+
+        prompt = "\n\n".join(f"Segment {index + 1}:\n{segment}" for index, (_, segment) in enumerate(batch))
+        try:
+            texts = await call(prompt, instructions, simplified_segments)
+        except UnexpectedModelBehavior as e:
+            # Raised again when the retry fails too, the request fails rather than answering with unsimplified text.
+            logger.warning(f"Failed to simplify {len(batch)} segments separately, retrying: {e}")
+            texts = await call(prompt, instructions, simplified_segments)
+        return {key: text for (key, _), text in zip(batch, texts, strict=True)}
+
+
+type _Call = Callable[[str, str | None, Callable[..., Any]], Awaitable[Any]]
+
+
+def _batches(segments: list[tuple[str, str]], max_chars: int) -> list[list[tuple[str, str]]]:
+    """Pack segments into batches of at most `max_chars` and `MAX_SEGMENTS_PER_CALL` segments."""
+    batches: list[list[tuple[str, str]]] = []
+    current: list[tuple[str, str]] = []
+    size = 0
+    for item in segments:
+        if current and (size + len(item[1]) > max_chars or len(current) >= MAX_SEGMENTS_PER_CALL):
+            batches.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += len(item[1])
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,25 @@
+import hashlib
+
+from .models import Config
+
+
+def fingerprint(text: str | None) -> str:
+    """Short, stable fingerprint of a (possibly large) text, used as cache key."""
+    if text is None:
+        return ""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def normalize_message(message: str) -> str:
+    """Normalize a message for comparison: collapse all whitespace."""
+    return " ".join(message.split())
+
+
+def config_fingerprint(config: Config) -> str:
+    """Canonical fingerprint of a config, independent of how it was created."""
+    return fingerprint(config.model_dump_json())
+
+
+def request_fingerprint(message: str, config: Config) -> str:
+    """Fingerprint of a (normalized) message combined with the config it is simplified for."""
+    return fingerprint(f"{config_fingerprint(config)}\n{normalize_message(message)}")
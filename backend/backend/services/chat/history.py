@@ -0,0 +1,133 @@
+import asyncio
+from dataclasses import replace
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from pydantic_ai.messages import ModelMessage, ModelRequest, SystemPromptPart, TextPart, UserPromptPart
+
+from backend.prompts import get_template
+from backend.utils.log import logger
+
+from .admission import AdmissionController, AdmissionRejected
+from .agents import agent_registry
+from .models import Conversation, StoredMessage
+from .store import ConversationStore, carry_over_instructions
+
+if TYPE_CHECKING:
+    from backend.core.settings import HistorySettings
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(message: ModelMessage) -> int:
+    """Rough estimate of the number of tokens of a message, good enough to budget the history."""
+    chars = sum(len(str(part.content)) for part in message.parts if hasattr(part, "content"))
+    return chars // CHARS_PER_TOKEN + 1
+
+
+class HistoryPolicy:
+    """Limits the message history sent to the model, summarizing older turns in the background."""
+
+    def __init__(self, settings: "HistorySettings", model: str, admission: AdmissionController, max_active: int):
+        self._settings = settings
+        self._model = settings.summary_model or model
+        self._admission = admission
+        self._max_active = max_active  # admission slots in use above which summaries are postponed
+        self._tasks: dict[UUID, asyncio.Task[None]] = {}
+
+    def window(
+        self, conversation: Conversation, messages: list[StoredMessage], store: ConversationStore
+    ) -> list[ModelMessage]:
+        """Return the message history to send to the model for the next turn."""
+        start = self._window_start(messages)
+
+        # Position of the first message in `messages` within the whole conversation.
+        offset = conversation.message_count - len(messages)
+        if self._settings.summarize and offset + start > conversation.summary_until:
+            self._schedule_summary(conversation, messages, offset, offset + start, store)
+            # The messages that the stored summary does not cover yet are kept until it does.
+            start = max(0, conversation.summary_until - offset)
+
+        kept = messages[start:]
+        carry_over_instructions(messages[:start], kept)
+
+        history = [stored.message for stored in kept]
+        if conversation.summary and history:
+            first = history[0]
+            if isinstance(first, ModelRequest):
+                summary = SystemPromptPart(content=f"Summary of the earlier conversation:\n{conversation.summary}")
+                history[0] = replace(first, parts=[summary, *first.parts])
+        return history
+
+    def _window_start(self, messages: list[StoredMessage]) -> int:
+        max_turns = self._settings.max_turns
+        max_tokens = self._settings.max_tokens
+
+        start = len(messages)
+        tokens = 0
+        # Walk back over whole request/response pairs, always keeping the last turn.
+        while start >= 2:
+            turn_tokens = sum(estimate_tokens(stored.message) for stored in messages[start - 2 : start])
+            turns = (len(messages) - start) // 2
+            if turns > 0 and (
+                (max_turns is not None and turns >= max_turns)
+                or (max_tokens is not None and tokens + turn_tokens > max_tokens)
+            ):
+                break
+            tokens += turn_tokens
+            start -= 2
+        return start
+
+    def _schedule_summary(
+        self,
+        conversation: Conversation,
+        messages: list[StoredMessage],
+        offset: int,
+        until: int,
+        store: ConversationStore,
+    ) -> None:
+        conversation_id = conversation.conversation_id
+        task = self._tasks.get(conversation_id)
+        if task is not None and not task.done():
+            return
+
+        # Messages before the summary (or trimmed by the store) are not summarized again.
+        to_summarize = messages[max(0, conversation.summary_until - offset) : until - offset]
+        if not to_summarize:
+            return
+
+        task = asyncio.create_task(self._summarize(conversation, to_summarize, until, store))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(conversation_id, None))
+
+    async def _summarize(
+        self,
+        conversation: Conversation,
+        messages: list[StoredMessage],
+        until: int,
+        store: ConversationStore,
+    ) -> None:
+        lines: list[str] = []
+        if conversation.summary:
+            lines.append(f"Summary of the conversation so far:\n{conversation.summary}\n")
+        lines.append("Conversation:")
+        for stored in messages:
+            role = "User" if isinstance(stored.message, ModelRequest) else "Assistant"
+            for part in stored.message.parts:
+                if isinstance(part, UserPromptPart | TextPart):
+                    lines.append(f"{role}: {part.content}")
+
+        try:
+            # A low priority call, it is postponed to a later turn under load, or when a chat request needs the slot.
+            async with self._admission.preemptible_slot(self._max_active):
+                agent = agent_registry.get(self._model, get_template("summary", {}))
+                result = await agent.run("\n".join(lines))
+        except AdmissionRejected:
+            logger.info(f"Postponed the summary of conversation {conversation.conversation_id}, the service is busy")
+            return
+        except Exception as e:
+            logger.exception(f"Failed to summarize conversation {conversation.conversation_id}: {e}")
+            return
+
+        store.update_summary(conversation, result.output, until)
+        logger.debug(f"Summarized conversation {conversation.conversation_id} until message {until}")
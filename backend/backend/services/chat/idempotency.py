@@ -0,0 +1,63 @@
+import asyncio
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from cachetools import TTLCache  # type: ignore
+
+from .models import IdempotencyStats, StoredMessage
+
+if TYPE_CHECKING:
+    from backend.core.settings import IdempotencySettings
+
+type IdempotencyKey = tuple[UUID, UUID]  # (conversation_id, message_id)
+
+
+class IdempotencyTable:
+    """Tracks chat messages by their client generated id, so a retried message is only processed once."""
+
+    def __init__(self, settings: "IdempotencySettings"):
+        self._settings = settings
+        self._replies: TTLCache[IdempotencyKey, StoredMessage] = TTLCache(
+            maxsize=settings.max_entries, ttl=settings.ttl_seconds
+        )
+        self._in_flight: dict[IdempotencyKey, asyncio.Future[StoredMessage | None]] = {}
+        self._replayed = 0
+        self._waited = 0
+
+    async def acquire(self, key: IdempotencyKey) -> StoredMessage | None:
+        """Return the reply if the message was processed before, otherwise claim it and return None."""
+        while True:
+            reply = self._replies.get(key)
+            if reply is not None:
+                self._replayed += 1
+                return reply
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self._in_flight[key] = asyncio.get_running_loop().create_future()
+                return None
+
+            self._waited += 1
+            # Shield the future, so a retry that gives up does not affect the original request.
+            reply = await asyncio.shield(in_flight)
+            if reply is not None:
+                self._replayed += 1
+                return reply
+            # The original request failed, try to claim the message again.
+
+    def release(self, key: IdempotencyKey, reply: StoredMessage | None) -> None:
+        """Release a claimed message with its reply, or None when processing failed so a retry can try again."""
+        if reply is not None:
+            self._replies[key] = reply
+
+        in_flight = self._in_flight.pop(key, None)
+        if in_flight is not None and not in_flight.done():
+            in_flight.set_result(reply)
+
+    def stats(self) -> IdempotencyStats:
+        return IdempotencyStats(
+            entries=len(self._replies),
+            in_flight=len(self._in_flight),
+            replayed=self._replayed,
+            waited=self._waited,
+        )
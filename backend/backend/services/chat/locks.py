@@ -0,0 +1,60 @@
+import asyncio
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from uuid import UUID
+
+from .models import ConversationLockStats
+from .waits import WaitTimes
+
+
+class _LockEntry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class ConversationLocks:
+    """Per-conversation locks, so the turns of a conversation run one after the other."""
+
+    def __init__(self) -> None:
+        self._entries: dict[UUID, _LockEntry] = {}
+        self._acquired = 0
+        self._contended = 0
+        self._waits = WaitTimes()
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: UUID) -> AsyncIterator[None]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            entry = self._entries[conversation_id] = _LockEntry()
+
+        entry.users += 1
+        try:
+            if entry.lock.locked():
+                self._contended += 1
+                start = time.monotonic()
+                await entry.lock.acquire()
+                self._waits.add(time.monotonic() - start)
+            else:
+                await entry.lock.acquire()
+            self._acquired += 1
+            try:
+                yield
+            finally:
+                entry.lock.release()
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._entries[conversation_id]
+
+    def stats(self) -> ConversationLockStats:
+        return ConversationLockStats(
+            locks=len(self._entries),
+            acquired=self._acquired,
+            contended=self._contended,
+            wait_seconds_avg=self._waits.average(),
+            wait_seconds_max=self._waits.max(),
+        )
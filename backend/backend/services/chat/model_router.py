@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from collections.abc import AsyncIterable, Awaitable, Callable
+from typing import TYPE_CHECKING, Any
+
+from pydantic_ai import AgentStreamEvent, RunContext
+from pydantic_ai.agent import EventStreamHandler
+from pydantic_ai.messages import ModelMessage
+
+from backend.utils.log import logger
+
+from .admission import AdmissionController
+from .history import CHARS_PER_TOKEN, estimate_tokens
+from .models import ChatRequest, ModelLatencyStats, ModelRouterStats
+
+if TYPE_CHECKING:
+    from backend.core.settings import ModelRouterSettings
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# A model call gets the model name, and an event stream handler to pass to `Agent.run`.
+type ModelCall[T] = Callable[[str, EventStreamHandler[Any]], Awaitable[T]]
+
+
+class ModelRouter:
+    """Chooses the model for a request, hedges calls that are slow to respond and falls back on failures."""
+
+    def __init__(self, settings: "ModelRouterSettings", default_model: str, admission: AdmissionController):
+        self._settings = settings
+        self._default_model = default_model
+        self._admission = admission
+        self._latencies: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=self._settings.latency_samples)
+        )
+        self._first_token_latencies: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=self._settings.latency_samples)
+        )
+        self._hedged = 0
+        self._hedges_won = 0
+        self._hedges_skipped = 0
+        self._fallbacks = 0
+
+    def select(self, request: ChatRequest, message_history: list[ModelMessage]) -> str:
+        """Choose the model for the request, based on its config and the size of the input."""
+        cheap_model = self._settings.cheap_model
+        if cheap_model and request.config.summary:
+            input_tokens = len(request.message) // CHARS_PER_TOKEN + sum(map(estimate_tokens, message_history))
+            if input_tokens <= self._settings.short_input_tokens:
+                return cheap_model
+        return self._default_model
+
+    async def run[T](self, model_name: str, call: ModelCall[T], hedge: bool = True) -> T:
+        """Run `call` with the model, hedged and with a fallback. Low priority calls pass `hedge=False`."""
+        fallback_model = self._settings.fallback_model
+        if not fallback_model or fallback_model == model_name:
+            return await self._timed(model_name, call, asyncio.Event())
+
+        first_token = asyncio.Event()
+        primary = asyncio.ensure_future(self._timed(model_name, call, first_token))
+        responding = asyncio.ensure_future(first_token.wait())
+        try:
+            delay = self._hedge_delay(model_name) if hedge else None
+            await asyncio.wait({primary, responding}, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            if not primary.done() and not first_token.is_set():
+                if self._admission.available():
+                    self._hedged += 1
+                    logger.info(f"Model {model_name} is slow to respond, hedging with {fallback_model}")
+                    return await self._race(primary, fallback_model, call)
+                self._hedges_skipped += 1
+
+            try:
+                return await primary
+            except Exception as e:
+                self._fallbacks += 1
+                logger.warning(f"Model {model_name} failed, falling back to {fallback_model}: {e}")
+                return await self._timed(fallback_model, call, asyncio.Event())
+        finally:
+            primary.cancel()
+            responding.cancel()
+
+    def stats(self) -> ModelRouterStats:
+        return ModelRouterStats(
+            models={
+                model_name: ModelLatencyStats(
+                    samples=len(samples),
+                    p50_seconds=percentile(list(samples), 0.5),
+                    p95_seconds=percentile(list(samples), 0.95),
+                    first_token_p50_seconds=percentile(list(self._first_token_latencies[model_name]), 0.5),
+                    first_token_p95_seconds=percentile(list(self._first_token_latencies[model_name]), 0.95),
+                )
+                for model_name, samples in self._latencies.items()
+            },
+            hedged=self._hedged,
+            hedges_won=self._hedges_won,
+            hedges_skipped=self._hedges_skipped,
+            fallbacks=self._fallbacks,
+        )
+
+    def _hedge_delay(self, model_name: str) -> float | None:
+        if self._settings.hedge_after_seconds is not None:
+            return self._settings.hedge_after_seconds
+
+        samples = self._first_token_latencies.get(model_name)
+        if samples is None or len(samples) < self._settings.hedge_min_samples:
+            return None
+        return percentile(list(samples), 0.95)
+
+    async def _race[T](self, primary: asyncio.Future[T], fallback_model: str, call: ModelCall[T]) -> T:
+        hedge = asyncio.ensure_future(self._hedge(fallback_model, call))
+        pending = {primary, hedge}
+        try:
+            # The first successful response wins, a failure only counts when both fail.
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedges_won += 1
+                        return task.result()
+            return primary.result()
+        finally:
+            hedge.cancel()
+
+    async def _hedge[T](self, model_name: str, call: ModelCall[T]) -> T:
+        async with self._admission.slot():
+            return await self._timed(model_name, call, asyncio.Event())
+
+    async def _timed[T](self, model_name: str, call: ModelCall[T], first_token: asyncio.Event) -> T:
+        start = time.monotonic()
+
+        async def event_stream_handler(_: RunContext[Any], events: AsyncIterable[AgentStreamEvent]) -> None:
+            async for _ in events:
+                if not first_token.is_set():
+                    first_token.set()
+                    self._first_token_latencies[model_name].append(time.monotonic() - start)
+
+        try:
+            result = await call(model_name, event_stream_handler)
+        except Exception:
+            # Failed calls count as well, a call that times out is slow. Cancelled calls did not finish, so they don't.
+            self._latencies[model_name].append(time.monotonic() - start)
+            raise
+        self._latencies[model_name].append(time.monotonic() - start)
+        return result
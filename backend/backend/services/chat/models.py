@@ -1,11 +1,50 @@
 from datetime import UTC, datetime
-from typing import Literal
+from enum import Enum
+from typing import Any, Literal
 from uuid import UUID, uuid4
 
-from pydantic import BaseModel, Field
-from pydantic_ai.messages import ModelMessage
+from beanie import Document
+from pydantic import BaseModel, Field, PrivateAttr, field_validator, model_validator
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+from pymongo import IndexModel
 
-from backend.api.routers.simplify.models import Config
+from backend.core.settings import settings
+from backend.services.content.models import ContentCacheStats
+from backend.services.rate_limit.models import RateLimitStats
+
+
+class LearningStyle(str, Enum):
+    NO_PREFERENCE = "no preference"  # cannot just remove this, because in site override we already select null;
+    # how do we know if it's null or no preference?
+    VISUAL = "visual"  # create diagrams
+    # AUDIO = "audio"
+    ANALOGIES = "analogies"  # use analogies
+
+
+class FamiliarityLevel(str, Enum):
+    BEGINNER = "beginner"
+    INTERMEDIATE = "intermediate"
+    ADVANCED = "advanced"
+
+
+class Config(BaseModel):
+    familiarity: FamiliarityLevel | None = Field(None, description="The user's familiarity level with the topic.")
+    background: str | None = Field(None, description="The user's background or prior knowledge. ")
+    context: str | None = Field(None, description="Add specific context or scenario for the interaction.")
+    strict_adherence: bool | None = Field(
+        None, description="Whether the AI should strictly adhere to the provided page content."
+    )
+    summary: bool | None = Field(None, description="Whether a summary of the information is required.")
+    purpose: str | None = Field(None, description="The primary purpose or goal of the user's interaction.")
+    learning_style: LearningStyle | None = Field(None, description="The user's preferred learning style.")
+
+    @field_validator("background", "context", "purpose", mode="before")
+    @classmethod
+    def empty_str_to_none(cls, v: str | None) -> str | None:
+        """Replace empty string with None."""
+        if v == "":
+            return None
+        return v
 
 
 class Conversation(BaseModel):
@@ -14,6 +53,34 @@ class Conversation(BaseModel):
     created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
     last_message_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
     message_count: int = 0
+    summary: str | None = None  # summary of the messages before position summary_until
+    summary_until: int = 0
+
+
+class ConversationDocument(Document, Conversation):
+    """Persisted conversation, used by the mongodb conversation store. Expires when idle for too long."""
+
+    class Settings:
+        name = "chat_conversations"
+        indexes = [
+            IndexModel("conversation_id", unique=True),
+            IndexModel("last_message_at", expireAfterSeconds=settings.chat.conversation_store.persisted_ttl_seconds),
+        ]
+
+
+class SegmentDocument(Document):
+    """Persisted simplified segment, used by the mongodb segment memory. Keyed by the segment and config hash."""
+
+    key: str
+    text: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+    class Settings:
+        name = "chat_segments"
+        indexes = [
+            IndexModel("key", unique=True),
+            IndexModel("created_at", expireAfterSeconds=settings.chat.segments.persisted_ttl_seconds),
+        ]
 
 
 class FrontendMessage(BaseModel):
@@ -27,13 +94,217 @@ class StoredMessage(BaseModel):
     message: ModelMessage
 
 
+class MessageDocument(Document):
+    """Persisted message, used by the mongodb conversation store. Expires independently of its conversation."""
+
+    conversation_id: UUID
+    message_id: UUID
+    position: int
+    message: dict[str, Any]
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+    class Settings:
+        name = "chat_messages"
+        indexes = [
+            IndexModel([("conversation_id", 1), ("position", 1)], unique=True),
+            IndexModel("created_at", expireAfterSeconds=settings.chat.conversation_store.persisted_ttl_seconds),
+        ]
+
+    @classmethod
+    def from_stored_message(cls, conversation_id: UUID, position: int, stored: StoredMessage) -> "MessageDocument":
+        return cls(
+            conversation_id=conversation_id,
+            message_id=stored.id,
+            position=position,
+            message=ModelMessagesTypeAdapter.dump_python([stored.message], mode="json")[0],
+        )
+
+    def to_stored_message(self) -> StoredMessage:
+        return StoredMessage(id=self.message_id, message=ModelMessagesTypeAdapter.validate_python([self.message])[0])
+
+
 class ChatRequest(BaseModel):
     conversation_id: UUID
     message_id: UUID
-    message: str
+    message: str = ""
     config: Config
+    content_hash: str | None = Field(
+        None, description="Hash of page content uploaded to the widget content endpoint, prepended to the message."
+    )
+    _question: str | None = PrivateAttr(None)
+
+    @model_validator(mode="after")
+    def message_or_content(self) -> "ChatRequest":
+        """Require a message, or uploaded content to simplify."""
+        if not self.message and self.content_hash is None:
+            raise ValueError("Either message or content_hash is required")
+        return self
+
+    @property
+    def question(self) -> str | None:
+        """The message of the user, when page content was prepended to it with `with_content`."""
+        return self._question
+
+    @property
+    def content(self) -> str:
+        """The content to simplify: the message without the question."""
+        return self.message.removesuffix(f"\n\n{self._question}") if self._question else self.message
+
+    def with_content(self, content: str) -> "ChatRequest":
+        """Prepend page content to the message. The original message is kept apart as the question about it."""
+        message = f"{content}\n\n{self.message}" if self.message else content
+        request = self.model_copy(update={"message": message})
+        request._question = self.message or None
+        return request
+
+
+type PrewarmStatus = Literal["started", "running", "ready", "skipped"]
+
+
+class PrewarmRequest(BaseModel):
+    content_hash: str = Field(..., description="Hash of page content uploaded to the widget content endpoint.")
+    config: Config
+
+
+class PrewarmResponse(BaseModel):
+    status: PrewarmStatus
 
 
 class ChatResponse(BaseModel):
     conversation_id: UUID
     message: FrontendMessage
+
+
+class ChatBatchItem(BaseModel):
+    content: str
+    config: Config
+
+
+class ChatBatchRequest(BaseModel):
+    items: list[ChatBatchItem]
+    persist: bool = Field(False, description="Store every item as a conversation, so it can be continued.")
+
+
+class ChatBatchItemResult(BaseModel):
+    index: int  # position of the item in the request
+    conversation_id: UUID | None = None  # only for persisted items
+    message: FrontendMessage | None = None
+    error: str | None = None
+
+
+class ChatStreamDelta(BaseModel):
+    content: str
+
+
+class ConversationStoreStats(BaseModel):
+    conversations: int
+    messages: int
+    bytes: int
+    max_conversations: int
+    max_messages_per_conversation: int
+    max_bytes: int
+    evictions: int
+    expirations: int
+
+
+class ResponseCacheStats(BaseModel):
+    enabled: bool
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+
+
+class NearDuplicateStats(BaseModel):
+    enabled: bool
+    entries: int
+    max_entries: int
+    hits: int
+    misses: int
+
+
+class SegmentMemoryStats(BaseModel):
+    enabled: bool
+    backend: str
+    entries: int  # in the hot tier
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+
+
+class PrewarmStats(BaseModel):
+    enabled: bool
+    entries: int  # finished, not yet expired
+    running: int
+    started: int
+    skipped: int  # not started or not admitted because of load or limits
+    claimed: int  # chat requests answered with a prewarmed response
+    cancelled: int
+    failed: int
+
+
+class SingleFlightStats(BaseModel):
+    in_flight: int
+    leaders: int
+    followers: int
+
+
+class ModelLatencyStats(BaseModel):
+    samples: int
+    p50_seconds: float
+    p95_seconds: float
+    first_token_p50_seconds: float
+    first_token_p95_seconds: float
+
+
+class ModelRouterStats(BaseModel):
+    models: dict[str, ModelLatencyStats]
+    hedged: int  # requests that also went to the fallback model because the primary was slow
+    hedges_won: int  # hedged requests answered by the fallback model
+    hedges_skipped: int  # slow requests that were not hedged, because no admission slot was free
+    fallbacks: int  # requests answered by the fallback model because the primary failed
+
+
+class IdempotencyStats(BaseModel):
+    entries: int
+    in_flight: int
+    replayed: int  # retries answered with the reply of the original request
+    waited: int  # retries that waited for the original request to finish
+
+
+class ConversationLockStats(BaseModel):
+    locks: int
+    acquired: int
+    contended: int  # acquisitions that had to wait for another turn of the conversation
+    wait_seconds_avg: float  # of the contended acquisitions
+    wait_seconds_max: float
+
+
+class AdmissionStats(BaseModel):
+    active: int
+    queued: int
+    max_concurrency: int
+    max_queue: int
+    admitted: int
+    rejected: int
+    timed_out: int
+    cancelled: int  # model calls cancelled while running, e.g. because the client disconnected
+    preempted: int  # low priority calls cancelled because a regular call needed the slot
+    wait_seconds_avg: float
+    wait_seconds_max: float
+
+
+class ChatStats(BaseModel):
+    conversation_store: ConversationStoreStats
+    response_cache: ResponseCacheStats
+    near_duplicates: NearDuplicateStats
+    segments: SegmentMemoryStats
+    prewarm: PrewarmStats
+    model_router: ModelRouterStats
+    single_flight: SingleFlightStats
+    idempotency: IdempotencyStats
+    conversation_locks: ConversationLockStats
+    admission: AdmissionStats
+    rate_limit: RateLimitStats
+    content_cache: ContentCacheStats
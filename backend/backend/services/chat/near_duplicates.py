@@ -0,0 +1,155 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict, defaultdict
+from copy import deepcopy
+from typing import TYPE_CHECKING
+
+from cachetools import LRUCache  # type: ignore
+from pydantic_ai.messages import ModelResponse
+
+from .fingerprints import config_fingerprint
+from .models import ChatRequest, NearDuplicateStats
+
+if TYPE_CHECKING:
+    from backend.core.settings import NearDuplicateSettings
+
+SIMHASH_BITS = 64
+WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int) -> set[str]:
+    """The distinct sequences of `size` consecutive words of the text."""
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[index : index + size]) for index in range(len(words) - size + 1)}
+
+
+def simhash(features: set[str]) -> int:
+    """64-bit SimHash of a set of features, with the per process salted builtin hash."""
+    mask = (1 << SIMHASH_BITS) - 1
+    bits = "".join(format(hash(feature) & mask, f"0{SIMHASH_BITS}b") for feature in features)
+    # Count the ones per bit position, every position is a slice of the concatenated bit strings.
+    result = 0
+    for position in range(SIMHASH_BITS):
+        result = (result << 1) | (bits[position::SIMHASH_BITS].count("1") * 2 > len(features))
+    return result
+
+
+def signature(text: str, shingle_size: int) -> int:
+    """SimHash of the shingles of a text."""
+    return simhash(shingles(text, shingle_size))
+
+
+class _Entry:
+    __slots__ = ("scope", "simhash", "response", "created_at")
+
+    def __init__(self, scope: str, simhash: int, response: ModelResponse):
+        self.scope = scope
+        self.simhash = simhash
+        self.response = response
+        self.created_at = time.monotonic()
+
+
+class NearDuplicateCache:
+    """Cache of AI responses to first-turn messages that also matches near-identical content."""
+
+    def __init__(self, settings: "NearDuplicateSettings"):
+        self._settings = settings
+        self._bands = settings.max_distance + 1
+        self._band_bits = SIMHASH_BITS // self._bands
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._buckets: defaultdict[tuple[str, int, int], set[int]] = defaultdict(set)
+        # A message is looked up and then stored, memoized by a hash of the content so it is not kept alive.
+        self._signatures: LRUCache[bytes, int] = LRUCache(maxsize=64)
+        self._next_id = 0
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._settings.enabled
+
+    def get(self, model_name: str, request: ChatRequest) -> ModelResponse | None:
+        if not self._applies(request):
+            return None
+
+        scope = self._scope(model_name, request)
+        message_hash = self._signature(request.content)
+        best: tuple[int, int] | None = None  # (distance, entry id)
+        for entry_id in self._candidates(scope, message_hash):
+            entry = self._entries[entry_id]
+            if time.monotonic() - entry.created_at > self._settings.ttl_seconds:
+                self._remove(entry_id)
+                continue
+            distance = (entry.simhash ^ message_hash).bit_count()
+            if distance <= self._settings.max_distance and (best is None or distance < best[0]):
+                best = (distance, entry_id)
+
+        if best is None:
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        self._entries.move_to_end(best[1])
+        return deepcopy(self._entries[best[1]].response)
+
+    def put(self, model_name: str, request: ChatRequest, response: ModelResponse) -> None:
+        if not self._applies(request):
+            return
+
+        scope = self._scope(model_name, request)
+        message_hash = self._signature(request.content)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(scope, message_hash, deepcopy(response))
+        for band in self._bands_of(message_hash):
+            self._buckets[(scope, *band)].add(entry_id)
+
+        while len(self._entries) > self._settings.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def stats(self) -> NearDuplicateStats:
+        return NearDuplicateStats(
+            enabled=self._settings.enabled,
+            entries=len(self._entries),
+            max_entries=self._settings.max_entries,
+            hits=self._hits,
+            misses=self._misses,
+        )
+
+    def _applies(self, request: ChatRequest) -> bool:
+        """Short messages are questions rather than content, a few different words change their meaning."""
+        return self._settings.enabled and len(WORD.findall(request.content)) >= self._settings.min_words
+
+    def _scope(self, model_name: str, request: ChatRequest) -> str:
+        """Only responses within the same scope are reused: the question about the content must match exactly."""
+        return f"{model_name}\n{config_fingerprint(request.config)}\n{request.question or ''}"
+
+    def _signature(self, content: str) -> int:
+        key = hashlib.blake2b(content.encode(), digest_size=16).digest()
+        result = self._signatures.get(key)
+        if result is None:
+            result = self._signatures[key] = signature(content, self._settings.shingle_size)
+        return result
+
+    def _bands_of(self, signature: int) -> list[tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [(band, (signature >> (band * self._band_bits)) & mask) for band in range(self._bands)]
+
+    def _candidates(self, scope: str, signature: int) -> set[int]:
+        candidates: set[int] = set()
+        for band in self._bands_of(signature):
+            candidates |= self._buckets.get((scope, *band), set())
+        return candidates
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for band in self._bands_of(entry.simhash):
+            key = (entry.scope, *band)
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
@@ -0,0 +1,101 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from copy import deepcopy
+from typing import TYPE_CHECKING
+
+from cachetools import TTLCache  # type: ignore
+from pydantic_ai.messages import ModelResponse
+
+from backend.utils.log import logger
+
+from .admission import AdmissionRejected
+from .models import PrewarmStats, PrewarmStatus
+
+if TYPE_CHECKING:
+    from backend.core.settings import PrewarmSettings
+
+
+class PrewarmCache:
+    """Responses to first messages that are generated speculatively, before the user asks for them."""
+
+    def __init__(self, settings: "PrewarmSettings"):
+        self._settings = settings
+        self._jobs: dict[str, asyncio.Task[None]] = {}
+        self._results: TTLCache[str, ModelResponse] = TTLCache(maxsize=settings.max_entries, ttl=settings.ttl_seconds)
+        self._started = 0
+        self._skipped = 0
+        self._claimed = 0
+        self._cancelled = 0
+        self._failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._settings.enabled
+
+    def pending(self, key: str) -> bool:
+        """Whether a prewarm for the key is running or finished."""
+        return key in self._jobs or key in self._results
+
+    def start(self, key: str, generate: Callable[[], Awaitable[ModelResponse]]) -> PrewarmStatus:
+        """Start generating the response for the key in the background, unless it is known or there are too many."""
+        if key in self._results:
+            return "ready"
+        if key in self._jobs:
+            return "running"
+        if len(self._jobs) >= self._settings.max_jobs:
+            return self.skip()
+
+        self._started += 1
+        self._jobs[key] = asyncio.create_task(self._run(key, generate))
+        return "started"
+
+    def skip(self) -> PrewarmStatus:
+        self._skipped += 1
+        return "skipped"
+
+    async def claim(self, key: str) -> ModelResponse | None:
+        """Return the prewarmed response for the key, waiting for the prewarm when it is still running."""
+        job = self._jobs.get(key)
+        if job is not None:
+            # Unlike awaiting the job, this does not raise when the job is cancelled.
+            await asyncio.wait([job])
+
+        response = self._results.get(key)
+        if response is None:
+            return None
+        self._claimed += 1
+        return deepcopy(response)
+
+    async def stop(self) -> None:
+        """Cancel the running prewarms."""
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+
+    def stats(self) -> PrewarmStats:
+        return PrewarmStats(
+            enabled=self._settings.enabled,
+            entries=len(self._results),
+            running=len(self._jobs),
+            started=self._started,
+            skipped=self._skipped,
+            claimed=self._claimed,
+            cancelled=self._cancelled,
+            failed=self._failed,
+        )
+
+    async def _run(self, key: str, generate: Callable[[], Awaitable[ModelResponse]]) -> None:
+        try:
+            async with asyncio.timeout(self._settings.max_job_seconds):
+                self._results[key] = await generate()
+        except AdmissionRejected:
+            self._skipped += 1
+        except asyncio.CancelledError:
+            self._cancelled += 1
+            raise
+        except Exception as e:
+            self._failed += 1
+            logger.warning(f"Prewarm failed: {e!r}")
+        finally:
+            del self._jobs[key]
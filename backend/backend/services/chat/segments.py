@@ -0,0 +1,111 @@
+import hashlib
+from typing import TYPE_CHECKING
+
+from cachetools import LRUCache  # type: ignore
+from pymongo import UpdateOne
+
+from backend.utils.log import logger
+
+from .fingerprints import normalize_message
+from .models import SegmentDocument, SegmentMemoryStats
+
+if TYPE_CHECKING:
+    from backend.core.settings import SegmentMemorySettings
+
+
+def segment_key(segment: str, config_key: str) -> str:
+    """Compact (128 bit) key of a normalized segment simplified for a config."""
+    return hashlib.blake2b(f"{config_key}\n{normalize_message(segment)}".encode(), digest_size=16).hexdigest()
+
+
+class SegmentMemory:
+    """In-process memory of simplified segments, keyed by the normalized segment and config."""
+
+    name = "memory"
+
+    def __init__(self, settings: "SegmentMemorySettings"):
+        self._settings = settings
+        self._hot: LRUCache[str, str] = LRUCache(maxsize=settings.max_bytes, getsizeof=len)
+        self._hits = 0
+        self._misses = 0
+
+    def applies(self, input_tokens: int) -> bool:
+        return self._settings.enabled and input_tokens > self._settings.min_input_tokens
+
+    async def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Return the simplified text of the known segments."""
+        unique_keys = list(dict.fromkeys(keys))
+        found = {key: self._hot[key] for key in unique_keys if key in self._hot}
+        missing = [key for key in unique_keys if key not in found]
+        if missing:
+            found |= await self._load(missing)
+        self._hits += len(found)
+        self._misses += len(unique_keys) - len(found)
+        return found
+
+    async def put_many(self, segments: dict[str, str]) -> None:
+        """Remember the simplified text of segments, by key."""
+        for key, text in segments.items():
+            self._put_hot(key, text)
+        if segments:
+            await self._save(segments)
+
+    def stats(self) -> SegmentMemoryStats:
+        return SegmentMemoryStats(
+            enabled=self._settings.enabled,
+            backend=self.name,
+            entries=len(self._hot),
+            bytes=int(self._hot.currsize),
+            max_bytes=self._settings.max_bytes,
+            hits=self._hits,
+            misses=self._misses,
+        )
+
+    def _put_hot(self, key: str, text: str) -> None:
+        if len(text) <= self._settings.max_bytes:
+            self._hot[key] = text
+
+    async def _load(self, keys: list[str]) -> dict[str, str]:
+        return {}
+
+    async def _save(self, segments: dict[str, str]) -> None:
+        pass
+
+
+class MongoSegmentMemory(SegmentMemory):
+    """Segment memory that is shared between workers and restarts through MongoDB."""
+
+    name = "mongodb"
+
+    async def _load(self, keys: list[str]) -> dict[str, str]:
+        try:
+            documents = await SegmentDocument.find({"key": {"$in": keys}}).to_list()
+        except Exception as e:
+            logger.exception(f"Failed to load segments: {e}")
+            return {}
+
+        for document in documents:
+            self._put_hot(document.key, document.text)
+        return {document.key: document.text for document in documents}
+
+    async def _save(self, segments: dict[str, str]) -> None:
+        try:
+            await SegmentDocument.get_motor_collection().bulk_write(
+                [
+                    UpdateOne(
+                        {"key": key},
+                        {"$setOnInsert": SegmentDocument(key=key, text=text).model_dump(exclude={"id", "revision_id"})},
+                        upsert=True,
+                    )
+                    for key, text in segments.items()
+                ],
+                ordered=False,
+            )
+        except Exception as e:
+            logger.exception(f"Failed to save segments: {e}")
+
+
+def create_segment_memory(settings: "SegmentMemorySettings") -> SegmentMemory:
+    if settings.backend == "mongodb":
+        return MongoSegmentMemory(settings)
+    return SegmentMemory(settings)
@@ -0,0 +1,52 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from .models import SingleFlightStats
+
+
+class _Call[T]:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task[T]):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight[T]:
+    """Coalesces concurrent calls with the same key into a single call."""
+
+    def __init__(self) -> None:
+        self._calls: dict[str, _Call[T]] = {}
+        self._leaders = 0
+        self._followers = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            self._leaders += 1
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self._followers += 1
+
+        call.waiters += 1
+        try:
+            # Shield the call, so cancelling this caller does not cancel it for the others.
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                # Forget it right away, so a new caller does not join the cancelled call.
+                self._forget(key, call)
+
+    def stats(self) -> SingleFlightStats:
+        return SingleFlightStats(in_flight=len(self._calls), leaders=self._leaders, followers=self._followers)
+
+    def _forget(self, key: str, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
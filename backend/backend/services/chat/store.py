@@ -0,0 +1,467 @@
+import asyncio
+from collections import OrderedDict, defaultdict
+from dataclasses import replace
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING, Any
+from uuid import UUID
+
+from beanie import Document
+from pydantic_ai.messages import ModelRequest
+from pydantic_core import to_jsonable_python
+from pymongo.errors import BulkWriteError
+
+from backend.utils.log import logger
+
+from .models import (
+    Config,
+    Conversation,
+    ConversationDocument,
+    ConversationStoreStats,
+    MessageDocument,
+    StoredMessage,
+)
+
+if TYPE_CHECKING:
+    from backend.core.settings import ConversationStoreSettings
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class _Entry:
+    __slots__ = ("conversation", "messages", "message_sizes", "size")
+
+    def __init__(self, conversation: Conversation):
+        self.conversation = conversation
+        self.messages: list[StoredMessage] = []
+        self.message_sizes: list[int] = []
+        self.size = len(conversation.model_dump_json())
+
+
+class ConversationStore:
+    """Bounded in-process store for conversations and their messages."""
+
+    def __init__(self, settings: "ConversationStoreSettings"):
+        self._settings = settings
+        self._entries: OrderedDict[UUID, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._messages = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, conversation_id: UUID) -> bool:
+        return conversation_id in self._entries
+
+    async def start(self) -> None:
+        """Start background work of the store, if any."""
+
+    async def stop(self) -> None:
+        """Stop background work of the store, if any."""
+
+    async def load(self, conversation_id: UUID) -> Conversation | None:
+        """Get a conversation, loading it into the store first if it is persisted elsewhere."""
+        return self.get(conversation_id)
+
+    def get(self, conversation_id: UUID) -> Conversation | None:
+        """Get a conversation and mark it as recently used. Returns None if it does not exist or has expired."""
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+
+        if self._is_expired(entry.conversation, datetime.now(UTC)):
+            self._remove(conversation_id)
+            self._expirations += 1
+            return None
+
+        self._entries.move_to_end(conversation_id)
+        return entry.conversation
+
+    def get_messages(self, conversation_id: UUID) -> list[StoredMessage]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return []
+        return list(entry.messages)
+
+    def create(self, conversation: Conversation) -> None:
+        """Add a new conversation, replacing any existing conversation with the same id."""
+        self._restore(conversation, [])
+
+    def update_config(self, conversation: Conversation, config: Config) -> None:
+        conversation.config = config
+
+    def update_summary(self, conversation: Conversation, summary: str, summary_until: int) -> None:
+        """Set the summary of the messages of the conversation before position `summary_until`."""
+        conversation.summary = summary
+        conversation.summary_until = summary_until
+
+    def append_messages(self, conversation: Conversation, messages: list[StoredMessage]) -> None:
+        """Append messages to a conversation, dropping the oldest pairs beyond the limit."""
+        entry = self._entries.get(conversation.conversation_id)
+        if entry is None:
+            logger.warning(f"Conversation {conversation.conversation_id} was evicted, adding it again")
+            self._restore(conversation, [])
+            entry = self._entries[conversation.conversation_id]
+        else:
+            self._entries.move_to_end(conversation.conversation_id)
+
+        self._add_messages(entry, messages)
+        entry.conversation.message_count += len(messages)
+        entry.conversation.last_message_at = datetime.now(UTC)
+
+        self._trim_messages(entry)
+        self._enforce_limits()
+
+    def evict_expired(self) -> int:
+        """Remove all conversations that have been idle for longer than the TTL. Returns the number removed."""
+        now = datetime.now(UTC)
+        expired = [key for key, entry in self._entries.items() if self._is_expired(entry.conversation, now)]
+        for key in expired:
+            self._remove(key)
+        self._expirations += len(expired)
+        return len(expired)
+
+    def stats(self) -> ConversationStoreStats:
+        return ConversationStoreStats(
+            conversations=len(self._entries),
+            messages=self._messages,
+            bytes=self._bytes,
+            max_conversations=self._settings.max_conversations,
+            max_messages_per_conversation=self._settings.max_messages_per_conversation,
+            max_bytes=self._settings.max_bytes,
+            evictions=self._evictions,
+            expirations=self._expirations,
+        )
+
+    def _restore(self, conversation: Conversation, messages: list[StoredMessage]) -> None:
+        """Add a conversation with its existing messages, without counting them as new messages."""
+        self._remove(conversation.conversation_id)
+        entry = _Entry(conversation)
+        self._entries[conversation.conversation_id] = entry
+        self._bytes += entry.size
+        self._add_messages(entry, messages)
+        self._trim_messages(entry)
+        self._enforce_limits()
+
+    def _add_messages(self, entry: _Entry, messages: list[StoredMessage]) -> None:
+        for message in messages:
+            size = len(message.model_dump_json())
+            entry.messages.append(message)
+            entry.message_sizes.append(size)
+            entry.size += size
+            self._bytes += size
+        self._messages += len(messages)
+
+    def _is_expired(self, conversation: Conversation, now: datetime) -> bool:
+        return now - conversation.last_message_at > timedelta(seconds=self._settings.idle_ttl_seconds)
+
+    def _remove(self, conversation_id: UUID) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            self._messages -= len(entry.messages)
+
+    def _trim_messages(self, entry: _Entry) -> None:
+        excess = len(entry.messages) - self._settings.max_messages_per_conversation
+        if excess <= 0:
+            return
+
+        # Drop whole request/response pairs, so the history still starts with a user request.
+        excess += excess % 2
+        dropped = entry.messages[:excess]
+        del entry.messages[:excess]
+        dropped_size = sum(entry.message_sizes[:excess])
+        del entry.message_sizes[:excess]
+        entry.size -= dropped_size
+        self._bytes -= dropped_size
+        self._messages -= len(dropped)
+
+        carry_over_instructions(dropped, entry.messages)
+
+    def _enforce_limits(self) -> None:
+        now = datetime.now(UTC)
+        # The least recently used conversations are at the front, evict those that have expired first.
+        while self._entries:
+            key = next(iter(self._entries))
+            if not self._is_expired(self._entries[key].conversation, now):
+                break
+            self._remove(key)
+            self._expirations += 1
+
+        # Never evict the most recently used conversation, that is the one being written to.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self._settings.max_conversations or self._bytes > self._settings.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+
+class MongoConversationStore(ConversationStore):
+    """Conversation store that is shared between workers through MongoDB, with write-behind."""
+
+    def __init__(self, settings: "ConversationStoreSettings"):
+        super().__init__(settings)
+        self._pending_conversations: dict[UUID, Conversation] = {}
+        self._pending_updates: dict[UUID, dict[str, Any]] = defaultdict(dict)
+        self._pending_messages: list[MessageDocument] = []
+        self._pending_counts: dict[UUID, int] = defaultdict(int)
+        self._flush_lock = asyncio.Lock()
+        self._failed_flushes = 0  # in a row
+        self._flush_task: asyncio.Task[None] | None = None
+        self._flush_loop_task: asyncio.Task[None] | None = None
+
+    async def start(self) -> None:
+        if self._flush_loop_task is None:
+            logger.info("Starting write-behind flush of the conversation store.")
+            self._flush_loop_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_loop_task is not None:
+            self._flush_loop_task.cancel()
+            self._flush_loop_task = None
+        await self.flush()
+
+    async def load(self, conversation_id: UUID) -> Conversation | None:
+        document = await ConversationDocument.find_one({"conversation_id": conversation_id})
+        conversation = self.get(conversation_id)
+        if conversation is not None:
+            # Another worker may have appended to the conversation since it was loaded into this one.
+            persisted_count = conversation.message_count - self._pending_counts.get(conversation_id, 0)
+            if document is None or document.message_count <= persisted_count:
+                return conversation
+            logger.info(f"Conversation {conversation_id} was changed by another worker, loading it again")
+        elif document is None:
+            # Evicted from the hot tier before it was flushed.
+            conversation = self._pending_conversations.get(conversation_id)
+            if conversation is None:
+                return None
+
+        if document is not None:
+            # The unflushed changes of a stale copy are dropped when they are flushed, as duplicates.
+            stale = conversation is not None
+            conversation = Conversation(**document.model_dump(exclude={"id", "revision_id"}))
+            # MongoDB returns naive datetimes (in UTC).
+            conversation.created_at = conversation.created_at.replace(tzinfo=UTC)
+            conversation.last_message_at = conversation.last_message_at.replace(tzinfo=UTC)
+            if stale:
+                self._pending_updates.pop(conversation_id, None)
+            else:
+                conversation.message_count += self._pending_counts.get(conversation_id, 0)
+                for field, value in self._pending_updates.get(conversation_id, {}).items():
+                    setattr(conversation, field, value)
+
+        self._restore(conversation, await self._load_messages(conversation))
+        return conversation
+
+    def create(self, conversation: Conversation) -> None:
+        super().create(conversation)
+        self._pending_conversations[conversation.conversation_id] = conversation
+
+    def update_config(self, conversation: Conversation, config: Config) -> None:
+        super().update_config(conversation, config)
+        self._pending_update(conversation, {"config": config})
+
+    def update_summary(self, conversation: Conversation, summary: str, summary_until: int) -> None:
+        super().update_summary(conversation, summary, summary_until)
+        self._pending_update(conversation, {"summary": summary, "summary_until": summary_until})
+
+    def append_messages(self, conversation: Conversation, messages: list[StoredMessage]) -> None:
+        position = conversation.message_count
+        super().append_messages(conversation, messages)
+
+        for offset, message in enumerate(messages):
+            self._pending_messages.append(
+                MessageDocument.from_stored_message(conversation.conversation_id, position + offset, message)
+            )
+        self._pending_counts[conversation.conversation_id] += len(messages)
+
+        if len(self._pending_messages) >= self._settings.flush_batch_size and (
+            self._flush_task is None or self._flush_task.done()
+        ):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        """Write all buffered changes to MongoDB."""
+        async with self._flush_lock:
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            updates, self._pending_updates = self._pending_updates, defaultdict(dict)
+            messages, self._pending_messages = self._pending_messages, []
+            counts, self._pending_counts = self._pending_counts, defaultdict(int)
+            if not (conversations or updates or messages or counts):
+                return
+
+            try:
+                await self._write(conversations, updates, messages, counts)
+                self._failed_flushes = 0
+            except Exception as e:
+                self._failed_flushes += 1
+                if self._failed_flushes >= self._settings.flush_max_attempts:
+                    logger.exception(
+                        f"Failed to flush conversation store {self._failed_flushes} times in a row, dropping "
+                        f"{len(conversations)} conversations, {len(updates)} updates and {len(messages)} messages: {e}"
+                    )
+                    self._failed_flushes = 0
+                    return
+                logger.exception(f"Failed to flush conversation store, retrying on the next flush: {e}")
+                self._requeue(conversations, updates, messages, counts)
+
+    def _pending_update(self, conversation: Conversation, fields: dict[str, Any]) -> None:
+        # New conversations are inserted with all their fields.
+        if conversation.conversation_id not in self._pending_conversations:
+            self._pending_updates[conversation.conversation_id].update(fields)
+
+    async def _write(
+        self,
+        conversations: dict[UUID, Conversation],
+        updates: dict[UUID, dict[str, Any]],
+        messages: list[MessageDocument],
+        counts: dict[UUID, int],
+    ) -> None:
+        """Write the changes. Written changes are removed from the arguments, so a failed flush retries the rest."""
+        if conversations:
+            # The message count is incremented below, together with the existing conversations.
+            failed, existing = await _insert_many(
+                [
+                    ConversationDocument(**conversation.model_dump(exclude={"message_count"}))
+                    for conversation in conversations.values()
+                ]
+            )
+            # Another worker created the conversation at the same time, continue with its copy.
+            for document in existing:
+                self._remove(document.conversation_id)
+            failed_ids = {document.conversation_id for document in failed}
+            for conversation_id in [key for key in conversations if key not in failed_ids]:
+                del conversations[conversation_id]
+            if conversations:
+                raise RuntimeError(f"Failed to insert {len(conversations)} conversations")
+        for conversation_id in list(updates):
+            await ConversationDocument.find_one({"conversation_id": conversation_id}).update(
+                {"$set": to_jsonable_python(updates[conversation_id])}
+            )
+            del updates[conversation_id]
+        if messages:
+            messages[:], existing = await _insert_many(messages)
+            # Another worker appended to the conversation at the same positions, from a stale copy of it. These
+            # messages are dropped, and the conversation is loaded again on its next turn.
+            for document in existing:
+                self._remove(document.conversation_id)
+                counts[document.conversation_id] -= 1
+                if not counts[document.conversation_id]:
+                    del counts[document.conversation_id]
+            if messages:
+                raise RuntimeError(f"Failed to insert {len(messages)} messages")
+
+        # Conversations are grouped by increment, which in practice is one user/AI pair per flush interval,
+        # so this is a single update_many.
+        by_increment: dict[int, list[UUID]] = defaultdict(list)
+        for conversation_id, count in counts.items():
+            by_increment[count].append(conversation_id)
+        now = datetime.now(UTC)
+        for increment, conversation_ids in by_increment.items():
+            await ConversationDocument.find({"conversation_id": {"$in": conversation_ids}}).update_many(
+                {"$inc": {"message_count": increment}, "$set": {"last_message_at": now}}
+            )
+            for conversation_id in conversation_ids:
+                del counts[conversation_id]
+
+    def _requeue(
+        self,
+        conversations: dict[UUID, Conversation],
+        updates: dict[UUID, dict[str, Any]],
+        messages: list[MessageDocument],
+        counts: dict[UUID, int],
+    ) -> None:
+        self._pending_conversations = conversations | self._pending_conversations
+        for conversation_id, fields in updates.items():
+            self._pending_updates[conversation_id] = fields | self._pending_updates[conversation_id]
+        self._pending_messages = messages + self._pending_messages
+        for conversation_id, count in counts.items():
+            self._pending_counts[conversation_id] += count
+
+        excess = len(self._pending_messages) - self._settings.max_pending_messages
+        if excess > 0:
+            logger.error(f"Too many unflushed messages, dropping the {excess} oldest")
+            del self._pending_messages[:excess]
+
+    async def _load_messages(self, conversation: Conversation) -> list[StoredMessage]:
+        conversation_id = conversation.conversation_id
+        limit = self._settings.max_messages_per_conversation
+        # Only load whole request/response pairs.
+        start = max(0, conversation.message_count - limit)
+        start += start % 2
+
+        documents = await MessageDocument.find(
+            {"conversation_id": conversation_id, "position": {"$gte": start}}
+        ).to_list()
+        positions = {document.position for document in documents}
+        documents.extend(
+            document
+            for document in self._pending_messages
+            if document.conversation_id == conversation_id
+            and document.position >= start
+            and document.position not in positions
+        )
+        documents.sort(key=lambda document: document.position)
+        messages = [document.to_stored_message() for document in documents]
+
+        if start > 0:
+            # The instructions are only stored with the first message of the conversation
+            # (or when the config changes), so find the latest ones before the loaded messages.
+            previous = (
+                await MessageDocument.find(
+                    {
+                        "conversation_id": conversation_id,
+                        "position": {"$lt": start},
+                        "message.instructions": {"$ne": None},
+                    }
+                )
+                .sort("-position")
+                .limit(1)
+                .to_list()
+            )
+            carry_over_instructions([document.to_stored_message() for document in previous], messages)
+
+        return messages
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._settings.flush_interval_seconds)
+            await self.flush()
+
+
+async def _insert_many[D: Document](documents: list[D]) -> tuple[list[D], list[D]]:
+    """Insert documents unordered, returns the documents that failed and those that already exist."""
+    try:
+        await type(documents[0]).insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        existing = [documents[error["index"]] for error in errors if error["code"] == DUPLICATE_KEY_ERROR]
+        if existing:
+            logger.warning(f"Skipped {len(existing)} {type(documents[0]).__name__} documents that already exist")
+        return [documents[error["index"]] for error in errors if error["code"] != DUPLICATE_KEY_ERROR], existing
+    return [], []
+
+
+def create_conversation_store(settings: "ConversationStoreSettings") -> ConversationStore:
+    if settings.backend == "mongodb":
+        return MongoConversationStore(settings)
+    return ConversationStore(settings)
+
+
+def carry_over_instructions(dropped: list[StoredMessage], messages: list[StoredMessage]) -> None:
+    """Copy the latest instructions of the dropped messages to the first of the remaining messages."""
+    instructions = next(
+        (
+            stored.message.instructions
+            for stored in reversed(dropped)
+            if isinstance(stored.message, ModelRequest) and stored.message.instructions
+        ),
+        None,
+    )
+    if not messages or instructions is None:
+        return
+
+    first = messages[0]
+    if isinstance(first.message, ModelRequest) and first.message.instructions is None:
+        messages[0] = StoredMessage(id=first.id, message=replace(first.message, instructions=instructions))
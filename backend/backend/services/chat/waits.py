@@ -0,0 +1,19 @@
+from collections import deque
+
+WAIT_SAMPLES = 1000
+
+
+class WaitTimes:
+    """The most recent wait times in seconds, for the stats."""
+
+    def __init__(self) -> None:
+        self._samples: deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def average(self) -> float:
+        return sum(self._samples) / len(self._samples) if self._samples else 0.0
+
+    def max(self) -> float:
+        return max(self._samples, default=0.0)
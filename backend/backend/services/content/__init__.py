@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+from typing import TYPE_CHECKING
+
+from cachetools import TTLCache  # type: ignore
+
+from backend.core.settings import settings
+from backend.utils.log import logger
+
+from .extract import extract_text, normalize_text
+from .models import ContentCacheStats, ContentDocument, ContentUpload, ExtractedContent
+
+if TYPE_CHECKING:
+    from backend.core.settings import ContentCacheSettings
+
+
+class InvalidContent(Exception):
+    pass
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def extract_content(upload: ContentUpload, site_id: str, max_upload_bytes: int) -> ExtractedContent:
+    """Verify and extract uploaded content. Raises `InvalidContent` when it is too large or has another hash."""
+    if len(upload.content.encode()) > max_upload_bytes:
+        raise InvalidContent(f"Content is larger than {max_upload_bytes} bytes")
+    if content_hash(upload.content) != upload.content_hash:
+        raise InvalidContent("Content does not match content_hash")
+
+    text = extract_text(upload.content) if upload.content_type == "html" else normalize_text(upload.content)
+    return ExtractedContent(
+        content_hash=upload.content_hash,
+        text_hash=content_hash(text),
+        site_id=site_id,
+        url=upload.url,
+        text=text,
+    )
+
+
+class ContentCache:
+    """In-process cache of extracted page content, keyed by the hash of the uploaded content."""
+
+    name = "memory"
+
+    def __init__(self, settings: "ContentCacheSettings"):
+        self._settings = settings
+        self._hot: TTLCache[str, ExtractedContent] = TTLCache(
+            maxsize=settings.max_bytes,
+            ttl=settings.ttl_seconds,
+            getsizeof=lambda content: len(content.text),
+        )
+        self._hits = 0
+        self._misses = 0
+
+    async def get(self, hash: str) -> ExtractedContent | None:
+        content = self._hot.get(hash)
+        if content is None:
+            content = await self._load(hash)
+            if content is not None:
+                self._put_hot(content)
+        if content is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return content
+
+    async def put(self, upload: ContentUpload, site_id: str) -> ExtractedContent:
+        """Extract and cache uploaded content. Raises `InvalidContent` when it is too large or has another hash."""
+        # Hashing and parsing up to `max_upload_bytes` of html would block the event loop.
+        content = await asyncio.to_thread(extract_content, upload, site_id, self._settings.max_upload_bytes)
+        self._put_hot(content)
+        await self._save(content)
+        return content
+
+    def stats(self) -> ContentCacheStats:
+        return ContentCacheStats(
+            backend=self.name,
+            entries=len(self._hot),
+            bytes=int(self._hot.currsize),
+            max_bytes=self._settings.max_bytes,
+            hits=self._hits,
+            misses=self._misses,
+        )
+
+    def _put_hot(self, content: ExtractedContent) -> None:
+        if len(content.text) <= self._settings.max_bytes:
+            self._hot[content.content_hash] = content
+
+    async def _load(self, hash: str) -> ExtractedContent | None:
+        return None
+
+    async def _save(self, content: ExtractedContent) -> None:
+        pass
+
+
+class MongoContentCache(ContentCache):
+    """Content cache that is shared between workers and restarts through MongoDB."""
+
+    name = "mongodb"
+
+    async def _load(self, hash: str) -> ExtractedContent | None:
+        try:
+            document = await ContentDocument.find_one({"content_hash": hash})
+        except Exception as e:
+            logger.exception(f"Failed to load content {hash}: {e}")
+            return None
+        return document
+
+    async def _save(self, content: ExtractedContent) -> None:
+        document = ContentDocument(**content.model_dump())
+        try:
+            await ContentDocument.get_motor_collection().update_one(
+                {"content_hash": content.content_hash},
+                {"$setOnInsert": document.model_dump(exclude={"id", "revision_id"})},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.exception(f"Failed to save content {content.content_hash}: {e}")
+
+
+def create_content_cache(settings: "ContentCacheSettings") -> ContentCache:
+    if settings.backend == "mongodb":
+        return MongoContentCache(settings)
+    return ContentCache(settings)
+
+
+content_cache = create_content_cache(settings.widget.content)
+
+__all__ = [
+    "ContentCache",
+    "MongoContentCache",
+    "content_cache",
+    "create_content_cache",
+    "InvalidContent",
+    "content_hash",
+    "extract_content",
+    "extract_text",
+    "normalize_text",
+]
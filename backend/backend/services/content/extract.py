@@ -0,0 +1,124 @@
+import re
+import unicodedata
+from html.parser import HTMLParser
+
+# Elements that never contain the content of the page.
+SKIPPED_TAGS = {
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "canvas",
+    "iframe",
+    "nav",
+    "header",
+    "footer",
+    "aside",
+    "form",
+    "button",
+    "select",
+}
+SKIPPED_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "dialog"}
+# Elements that hold the main content, when a page has them, only their text is used.
+MAIN_TAGS = {"main", "article"}
+BLOCK_TAGS = {
+    "address",
+    "blockquote",
+    "br",
+    "dd",
+    "div",
+    "dl",
+    "dt",
+    "figcaption",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "hr",
+    "li",
+    "ol",
+    "p",
+    "pre",
+    "section",
+    "table",
+    "td",
+    "th",
+    "tr",
+    "ul",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+HEADINGS = {"h1": "# ", "h2": "## ", "h3": "### ", "h4": "#### ", "h5": "##### ", "h6": "###### "}
+
+WHITESPACE = re.compile(r"\s+")
+SPACES = re.compile(r"[ \t\f\v ]+")
+BLANK_LINES = re.compile(r"\n{3,}")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.text: list[str] = []
+        self.main_text: list[str] = []
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._open: list[tuple[str, bool, bool]] = []  # (tag, skipped, main)
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS:
+                self._append("\n")
+            return
+
+        attributes = dict(attrs)
+        skipped = tag in SKIPPED_TAGS or attributes.get("role") in SKIPPED_ROLES or "hidden" in attributes
+        main = tag in MAIN_TAGS or attributes.get("role") == "main"
+        self._open.append((tag, skipped, main))
+        self._skip_depth += skipped
+        self._main_depth += main
+
+        if tag in BLOCK_TAGS:
+            self._append("\n\n" + HEADINGS.get(tag, ""))
+
+    def handle_endtag(self, tag: str) -> None:
+        # Pop up to the matching tag, so unclosed elements do not leave the state inconsistent.
+        for index in range(len(self._open) - 1, -1, -1):
+            if self._open[index][0] == tag:
+                for _, skipped, main in self._open[index:]:
+                    self._skip_depth -= skipped
+                    self._main_depth -= main
+                del self._open[index:]
+                break
+        if tag in BLOCK_TAGS:
+            self._append("\n\n")
+
+    def handle_data(self, data: str) -> None:
+        # Like browsers do, whitespace collapses to a single space, except in preformatted text.
+        if not any(tag == "pre" for tag, _, _ in self._open):
+            data = WHITESPACE.sub(" ", data)
+        self._append(data)
+
+    def _append(self, text: str) -> None:
+        if self._skip_depth:
+            return
+        self.text.append(text)
+        if self._main_depth:
+            self.main_text.append(text)
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace, so the same content always has the same text."""
+    text = unicodedata.normalize("NFKC", text)
+    lines = (SPACES.sub(" ", line).strip() for line in text.splitlines())
+    return BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+
+def extract_text(html: str) -> str:
+    """Extract the readable text of an HTML page, without boilerplate and with markdown headings."""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    text = normalize_text("".join(extractor.main_text))
+    return text or normalize_text("".join(extractor.text))
@@ -0,0 +1,55 @@
+from datetime import UTC, datetime
+from typing import Literal
+
+from beanie import Document
+from pydantic import BaseModel, Field
+from pymongo import IndexModel
+
+from backend.core.settings import settings
+
+
+class ContentLookup(BaseModel):
+    url: str
+    content_hash: str = Field(..., description="sha256 hex digest of the content, as it would be uploaded.")
+
+
+class ContentUpload(ContentLookup):
+    content: str
+    content_type: Literal["html", "text"] = "html"
+
+
+class ExtractedContent(BaseModel):
+    content_hash: str
+    text_hash: str  # sha256 of the extracted text, the same for pages that only differ in boilerplate
+    site_id: str
+    url: str
+    text: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(UTC))
+
+
+class ContentDocument(Document, ExtractedContent):
+    """Persisted extracted content, used by the mongodb content cache. Keyed by the hash of the uploaded content."""
+
+    class Settings:
+        name = "widget_contents"
+        indexes = [
+            IndexModel("content_hash", unique=True),
+            IndexModel("created_at", expireAfterSeconds=settings.widget.content.ttl_seconds),
+        ]
+
+
+class ContentInfo(BaseModel):
+    """Extracted content without the text, returned to the widget."""
+
+    content_hash: str
+    text_hash: str
+    length: int
+
+
+class ContentCacheStats(BaseModel):
+    backend: str
+    entries: int  # in the hot tier
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
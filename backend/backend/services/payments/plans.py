@@ -8,7 +8,7 @@ from backend.api.routers.payments.models import Plan, Plans
 from backend.utils.log import logger
 
 if TYPE_CHECKING:
-    from backend.api.routers.payments.models import PaymentProvider
+    from backend.core.settings import PaymentProvider
 
 
 class PlansManager:
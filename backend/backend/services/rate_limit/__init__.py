@@ -0,0 +1,71 @@
+import math
+import time
+from typing import TYPE_CHECKING
+
+from .backends import MemoryRateLimitBackend, MongoRateLimitBackend
+from .models import RateLimitStats
+
+if TYPE_CHECKING:
+    from backend.core.settings import RateLimit, RateLimitSettings
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, scope: str, retry_after: int):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"Rate limit exceeded for {scope}")
+
+
+class RateLimiter:
+    """Sliding window rate limiter, estimated from the counts of the current and previous window."""
+
+    def __init__(self, settings: "RateLimitSettings", backend: MemoryRateLimitBackend):
+        self._settings = settings
+        self._backend = backend
+        self._allowed = 0
+        self._rejected = 0
+
+    async def start(self) -> None:
+        await self._backend.start()
+
+    async def stop(self) -> None:
+        await self._backend.stop()
+
+    def hit(self, scope: str, key: str, limit: "RateLimit") -> None:
+        """Count a request for the key within the scope. Raises `RateLimitExceeded` when it exceeds the limit."""
+        if not self._settings.enabled:
+            return
+
+        now = time.time()
+        window = limit.window_seconds
+        current_start = int(now // window) * window
+        current_key = f"{scope}:{window}:{current_start}:{key}"
+        previous_key = f"{scope}:{window}:{current_start - window}:{key}"
+
+        previous_weight = 1 - (now - current_start) / window
+        rate = self._backend.get(previous_key) * previous_weight + self._backend.get(current_key)
+        if rate >= limit.limit:
+            self._rejected += 1
+            raise RateLimitExceeded(scope, retry_after=max(1, math.ceil(current_start + window - now)))
+
+        # The counter is needed until the end of the next window, where it is the previous window.
+        self._backend.add(current_key, current_start + 2 * window)
+        self._allowed += 1
+
+    def stats(self) -> RateLimitStats:
+        return RateLimitStats(
+            backend=self._backend.name,
+            keys=len(self._backend),
+            allowed=self._allowed,
+            rejected=self._rejected,
+            pending=self._backend.pending,
+        )
+
+
+def create_rate_limiter(settings: "RateLimitSettings") -> RateLimiter:
+    if settings.backend == "mongodb":
+        return RateLimiter(settings, MongoRateLimitBackend(settings))
+    return RateLimiter(settings, MemoryRateLimitBackend(settings))
+
+
+__all__ = ["RateLimitExceeded", "RateLimiter", "create_rate_limiter"]
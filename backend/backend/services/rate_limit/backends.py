@@ -0,0 +1,147 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING
+
+from pymongo import UpdateOne
+
+from backend.utils.log import logger
+
+from .models import RateLimitCounterDocument
+
+if TYPE_CHECKING:
+    from backend.core.settings import RateLimitSettings
+
+
+class MemoryRateLimitBackend:
+    """Request counters in the memory of this worker, bounded to `max_keys` counters."""
+
+    name = "memory"
+
+    def __init__(self, settings: "RateLimitSettings"):
+        self._settings = settings
+        self._counts: dict[str, int] = {}
+        self._expires: dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    @property
+    def pending(self) -> int:
+        return 0
+
+    async def start(self) -> None:
+        """Start background work of the backend, if any."""
+
+    async def stop(self) -> None:
+        """Stop background work of the backend, if any."""
+
+    def get(self, key: str) -> int:
+        return self._counts.get(key, 0)
+
+    def add(self, key: str, expires_at: float) -> None:
+        """Count a request for the key. `expires_at` is the unix time after which the counter is not needed anymore."""
+        self._set(key, self._counts.get(key, 0) + 1, expires_at)
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        expired = [key for key, expires_at in self._expires.items() if expires_at <= now]
+        for key in expired:
+            del self._counts[key]
+            del self._expires[key]
+        return len(expired)
+
+    def _set(self, key: str, count: int, expires_at: float) -> None:
+        if key not in self._counts and len(self._counts) >= self._settings.max_keys:
+            self.evict_expired()
+            # Still full, drop the oldest counters.
+            while len(self._counts) >= self._settings.max_keys:
+                oldest = next(iter(self._counts))
+                del self._counts[oldest]
+                del self._expires[oldest]
+        self._counts[key] = count
+        self._expires.setdefault(key, expires_at)
+
+
+class MongoRateLimitBackend(MemoryRateLimitBackend):
+    """Request counters shared by all workers through batched atomic increments in MongoDB."""
+
+    name = "mongodb"
+
+    def __init__(self, settings: "RateLimitSettings"):
+        super().__init__(settings)
+        self._pending: defaultdict[str, int] = defaultdict(int)
+        self._used: set[str] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_loop_task: asyncio.Task[None] | None = None
+
+    @property
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    async def start(self) -> None:
+        if self._flush_loop_task is None:
+            logger.info("Starting flush of the rate limit counters.")
+            self._flush_loop_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_loop_task is not None:
+            self._flush_loop_task.cancel()
+            self._flush_loop_task = None
+        await self.flush()
+
+    def get(self, key: str) -> int:
+        self._used.add(key)
+        return super().get(key)
+
+    def add(self, key: str, expires_at: float) -> None:
+        super().add(key, expires_at)
+        self._pending[key] += 1
+
+    async def flush(self) -> None:
+        """Write the locally aggregated increments to MongoDB and refresh the used counters."""
+        async with self._flush_lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            used, self._used = self._used, set()
+            keys = used | pending.keys()
+            if not keys:
+                return
+
+            try:
+                if pending:
+                    await RateLimitCounterDocument.get_motor_collection().bulk_write(
+                        [
+                            UpdateOne(
+                                {"key": key},
+                                {
+                                    "$inc": {"hits": count},
+                                    "$setOnInsert": {"expires_at": self._expires_at(key)},
+                                },
+                                upsert=True,
+                            )
+                            for key, count in pending.items()
+                        ],
+                        ordered=False,
+                    )
+                documents = await RateLimitCounterDocument.find({"key": {"$in": list(keys)}}).to_list()
+            except Exception as e:
+                logger.exception(f"Failed to flush rate limit counters, retrying on the next flush: {e}")
+                for key, count in pending.items():
+                    self._pending[key] += count
+                self._used |= used
+                return
+
+            for document in documents:
+                # Increments made during the flush are not in the shared count yet.
+                count = document.hits + self._pending.get(document.key, 0)
+                self._set(document.key, count, document.expires_at.replace(tzinfo=UTC).timestamp())
+
+    def _expires_at(self, key: str) -> datetime:
+        return datetime.fromtimestamp(self._expires.get(key, time.time()), UTC)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._settings.flush_interval_seconds)
+            await self.flush()
+            self.evict_expired()
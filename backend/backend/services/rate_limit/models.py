@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from beanie import Document
+from pydantic import BaseModel
+from pymongo import IndexModel
+
+
+class RateLimitCounterDocument(Document):
+    """Request counter of a single key in a single window, shared by all workers. Expires after the window."""
+
+    key: str
+    hits: int = 0
+    expires_at: datetime
+
+    class Settings:
+        name = "rate_limit_counters"
+        indexes = [
+            IndexModel("key", unique=True),
+            IndexModel("expires_at", expireAfterSeconds=0),
+        ]
+
+
+class RateLimitStats(BaseModel):
+    backend: str
+    keys: int
+    allowed: int
+    rejected: int
+    pending: int  # increments not yet written to the shared backend
@@ -0,0 +1,74 @@
+import asyncio
+from typing import TYPE_CHECKING
+
+from backend.core.settings import settings
+from backend.utils.log import logger
+
+from .bloom import BloomFilter
+from .cache import SiteCache
+from .models import Site
+from .registry import SiteRegistry
+from .sessions import WidgetSessions
+from .shared_index import SharedSiteIndex
+
+if TYPE_CHECKING:
+    from backend.core.settings import SiteVerificationSettings
+
+
+class SiteFilter:
+    """Bloom filter of the ids of all active sites, to reject unknown site ids without a lookup."""
+
+    def __init__(self, settings: "SiteVerificationSettings"):
+        self._settings = settings
+        self._enabled = settings.filter_enabled
+        self._filter: BloomFilter | None = None
+        self._refresh_task: asyncio.Task[None] | None = None
+
+    def might_exist(self, site_id: str) -> bool:
+        return self._filter is None or site_id in self._filter
+
+    async def start(self) -> None:
+        if self._enabled and self._refresh_task is None:
+            logger.info("Starting periodic rebuild of the site filter.")
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def rebuild(self) -> None:
+        cursor = Site.get_motor_collection().find({"active": True}, projection={"site_id": True, "_id": False})
+        site_ids = [document["site_id"] async for document in cursor]
+        self._filter = BloomFilter.from_items(site_ids, self._settings.filter_false_positive_rate)
+        logger.info(f"Rebuilt the site filter with {len(site_ids)} sites in {self._filter.size_bytes} bytes")
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.exception(f"Failed to rebuild the site filter, keeping the previous one: {e}")
+            await asyncio.sleep(self._settings.filter_refresh_seconds)
+
+
+site_filter = SiteFilter(settings.widget.sites)
+site_registry = SiteRegistry(settings.widget.sites)
+shared_site_index = SharedSiteIndex(settings.widget.sites, site_registry)
+site_cache = SiteCache(settings.widget.sites)
+widget_sessions = WidgetSessions(settings.widget.session)
+
+__all__ = [
+    "Site",
+    "SiteFilter",
+    "site_filter",
+    "SiteRegistry",
+    "site_registry",
+    "SharedSiteIndex",
+    "shared_site_index",
+    "SiteCache",
+    "site_cache",
+    "WidgetSessions",
+    "widget_sessions",
+    "BloomFilter",
+]
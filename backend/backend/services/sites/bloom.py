@@ -0,0 +1,44 @@
+import hashlib
+import math
+from collections.abc import Iterable
+
+
+class BloomFilter:
+    """Set membership test in a fixed number of bits, without false negatives."""
+
+    def __init__(self, capacity: int, false_positive_rate: float):
+        capacity = max(capacity, 1)
+        self._size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    @classmethod
+    def from_items(cls, items: Iterable[str], false_positive_rate: float) -> "BloomFilter":
+        items = list(items)
+        bloom_filter = cls(len(items), false_positive_rate)
+        for item in items:
+            bloom_filter.add(item)
+        return bloom_filter
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def _positions(self, item: str) -> list[int]:
+        # Double hashing: k positions from the two halves of a single digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8])
+        second = int.from_bytes(digest[8:]) | 1
+        return [(first + index * second) % self._size for index in range(self._hashes)]
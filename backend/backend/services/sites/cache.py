@@ -0,0 +1,73 @@
+import asyncio
+import random
+import time
+from typing import TYPE_CHECKING
+
+from cachetools import LRUCache  # type: ignore
+
+from backend.utils.log import logger
+
+from .models import Site
+
+if TYPE_CHECKING:
+    from backend.core.settings import SiteVerificationSettings
+
+type SiteKey = tuple[str, str]  # (site_id, domain)
+
+
+class _Entry:
+    __slots__ = ("site", "fresh_until", "stale_until")
+
+    def __init__(self, site: Site | None, fresh_until: float, stale_until: float):
+        self.site = site
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class SiteCache:
+    """Cache of site lookups, including those that found nothing, that protects the database."""
+
+    def __init__(self, settings: "SiteVerificationSettings"):
+        self._settings = settings
+        self._entries: LRUCache[SiteKey, _Entry] = LRUCache(maxsize=settings.cache_max_entries)
+        self._loads: dict[SiteKey, asyncio.Task[Site | None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, site_id: str, domain: str) -> Site | None:
+        """The active site with the id and domain."""
+        key = (site_id, domain)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and now < entry.fresh_until:
+            return entry.site
+        if entry is not None and now < entry.stale_until:
+            self._load(key)
+            return entry.site
+        # Shield the lookup, so a cancelled request does not cancel it for the others.
+        return await asyncio.shield(self._load(key))
+
+    def _load(self, key: SiteKey) -> asyncio.Task[Site | None]:
+        task = self._loads.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key))
+            self._loads[key] = task
+            task.add_done_callback(lambda _: self._done(key, task))
+        return task
+
+    def _done(self, key: SiteKey, task: asyncio.Task[Site | None]) -> None:
+        del self._loads[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Lookup of site {key} failed: {task.exception()!r}")
+
+    async def _fetch(self, key: SiteKey) -> Site | None:
+        site_id, domain = key
+        logger.info(f"Lookup {domain=}/{site_id=}")
+        site = await Site.find_by_domain_and_site_id(domain, site_id)
+
+        ttl = self._settings.cache_ttl_seconds if site is not None else self._settings.unknown_ttl_seconds
+        ttl *= 1 - random.uniform(0, self._settings.cache_ttl_jitter)
+        now = time.monotonic()
+        self._entries[key] = _Entry(site, now + ttl, now + ttl + self._settings.cache_stale_seconds)
+        return site
@@ -0,0 +1,57 @@
+from datetime import UTC, datetime
+
+from beanie import Document
+from cachetools import LRUCache  # type: ignore
+from pydantic import BaseModel, Field
+from pymongo import IndexModel
+
+MAX_SITE_OBJECTS = 10_000
+
+
+class Site(Document):
+    """Site model for storing registered domains and their siteIds"""
+
+    domain: str  # example.com
+    site_id: str  # random uuid
+    owner_id: str | None = None  # tenant
+    active: bool = True
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(UTC))  # set on every change, for the registry
+
+    class Settings:
+        name = "sites"
+        indexes = [IndexModel("updated_at")]
+
+    @classmethod
+    async def find_by_domain_and_site_id(cls, domain: str, site_id: str) -> "Site | None":
+        """Find a site by domain and site_id"""
+        return await cls.find_one({"domain": domain, "site_id": site_id, "active": True})
+
+    @classmethod
+    async def is_valid(cls, domain: str, site_id: str) -> bool:
+        """Check if a domain and site_id combination is valid"""
+        site: Site | None = await cls.find_by_domain_and_site_id(domain, site_id)
+        return site is not None
+
+
+class WidgetSession(BaseModel):
+    token: str  # send it in the x-widget-session header
+    expires_at: datetime
+
+
+class SiteObjects:
+    """Kept `Site` objects of active sites, creating a document is slower than the lookups that find them."""
+
+    def __init__(self) -> None:
+        self._sites: LRUCache[tuple[str, str], Site] = LRUCache(maxsize=MAX_SITE_OBJECTS)
+
+    def cached(self, site_id: str, domain: str) -> Site | None:
+        return self._sites.get((site_id, domain))
+
+    def get(self, site_id: str, domain: str) -> Site:
+        site = self._sites.get((site_id, domain))
+        if site is None:
+            site = self._sites[(site_id, domain)] = Site.model_construct(domain=domain, site_id=site_id, active=True)
+        return site
+
+    def clear(self) -> None:
+        self._sites.clear()
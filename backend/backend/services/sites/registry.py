@@ -0,0 +1,203 @@
+import asyncio
+import time
+from collections.abc import Iterable
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from backend.utils.log import logger
+
+from .models import Site
+
+if TYPE_CHECKING:
+    from backend.core.settings import SiteVerificationSettings
+
+type SiteIndex = dict[str, dict[str, Site]]  # site_id -> domain -> active site
+
+CHANGE_STREAMS_NOT_SUPPORTED = 40573  # standalone servers only support polling
+
+
+def _to_site(document: dict[str, Any]) -> Site:
+    # The documents come from the database, so they are not validated again.
+    return Site.model_construct(
+        id=document["_id"],
+        domain=document["domain"],
+        site_id=document["site_id"],
+        owner_id=document.get("owner_id"),
+        active=document.get("active", True),
+    )
+
+
+class SiteRegistry:
+    """All active sites in memory, kept in sync with a change stream or by polling."""
+
+    def __init__(self, settings: "SiteVerificationSettings"):
+        self._settings = settings
+        self._index: SiteIndex | None = None
+        # document id -> (site_id, domain, active) of all sites, to apply deletes
+        self._keys: dict[ObjectId, tuple[str, str, bool]] = {}
+        self._version = 0  # incremented on every change
+        self._synced_until: datetime | None = None  # the latest updated_at that was loaded
+        self._loaded_at = 0.0
+        self._resume_token: Any = None  # of the last change applied from the change stream
+        self._watching = False
+        self._sync_task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return sum(len(domains) for domains in (self._index or {}).values())
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def sites(self) -> list[tuple[str, str, bool]]:
+        """(site_id, domain, active) of all known sites, including the inactive ones."""
+        return list(self._keys.values())
+
+    @property
+    def enabled(self) -> bool:
+        return self._settings.registry_enabled
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    @property
+    def watching(self) -> bool:
+        """Whether changes are applied as they happen, so a site that is not in the registry does not exist."""
+        return self._watching and self._index is not None
+
+    def get(self, site_id: str, domain: str) -> Site | None:
+        """The active site with the id and domain. Only valid when the registry is `ready`."""
+        assert self._index is not None
+        domains = self._index.get(site_id)
+        return domains.get(domain) if domains is not None else None
+
+    async def start(self) -> None:
+        # With a shared index file, the registry is only loaded by the worker that writes the file.
+        if self.enabled and not self._settings.registry_shared_file:
+            await self.load()
+
+    async def load(self) -> None:
+        """Load the sites and keep them in sync in the background."""
+        if self._sync_task is not None:
+            return
+        try:
+            await self.reload()
+        except Exception as e:
+            # Verification falls back to database lookups until the sync loop manages to load the sites.
+            logger.exception(f"Failed to load the site registry: {e}")
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def reload(self) -> None:
+        """Load all sites into a new snapshot."""
+        documents = await Site.get_motor_collection().find({}).to_list(None)
+        self._index, self._keys = {}, {}
+        self._apply(documents, [])
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(self)} active sites into the site registry")
+
+    async def refresh(self) -> None:
+        """Apply the sites that changed since the last load."""
+        # Sites without `updated_at` (older documents, other writers) are only picked up by a full reload.
+        query = {"updated_at": {"$exists": True} if self._synced_until is None else {"$gte": self._synced_until}}
+        documents = await Site.get_motor_collection().find(query).to_list(None)
+        if documents:
+            self._apply(documents, [])
+
+    def _apply(self, documents: Iterable[dict[str, Any]], deleted: Iterable[ObjectId]) -> None:
+        """Apply changed and deleted documents to a copy of the index, and swap it in."""
+        index = dict(self._index or {})
+        keys = dict(self._keys)
+
+        def remove(document_id: ObjectId) -> None:
+            key = keys.pop(document_id, None)
+            if key is not None and key[2]:
+                domains = {domain: site for domain, site in index.get(key[0], {}).items() if domain != key[1]}
+                if domains:
+                    index[key[0]] = domains
+                else:
+                    index.pop(key[0], None)
+
+        for document_id in deleted:
+            remove(document_id)
+        for document in documents:
+            remove(document["_id"])
+            if document.get("updated_at") is not None and (
+                self._synced_until is None or document["updated_at"] > self._synced_until
+            ):
+                self._synced_until = document["updated_at"]
+            site = _to_site(document)
+            if site.active:
+                index[site.site_id] = {**index.get(site.site_id, {}), site.domain: site}
+            keys[document["_id"]] = (site.site_id, site.domain, site.active)
+
+        self._index, self._keys = index, keys
+        self._version += 1
+
+    async def _watch(self) -> None:
+        """Apply changes from a change stream until the next full reload. Raises when the stream fails."""
+        async with Site.get_motor_collection().watch(
+            full_document="updateLookup", resume_after=self._resume_token
+        ) as stream:
+            if self._resume_token is None:
+                await self.reload()
+            logger.info("Watching the sites collection for changes.")
+            self._watching = True
+            try:
+                while time.monotonic() - self._loaded_at < self._settings.registry_full_reload_seconds:
+                    change = await stream.try_next()
+                    if change is not None:
+                        if change["operationType"] == "delete":
+                            self._apply([], [change["documentKey"]["_id"]])
+                        elif change.get("fullDocument") is not None:
+                            self._apply([change["fullDocument"]], [])
+                    self._resume_token = stream.resume_token
+            finally:
+                self._watching = False
+        self._resume_token = None
+
+    async def _watch_loop(self) -> None:
+        """Keep watching for changes, returns when change streams are not available."""
+        while True:
+            try:
+                await self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_NOT_SUPPORTED:
+                    logger.info(f"No change stream for the site registry, polling for changes instead: {e}")
+                    return
+                # E.g. the resume token is no longer in the oplog, watch again from a full reload.
+                self._resume_token = None
+                logger.warning(f"The change stream of the site registry failed, watching again: {e}")
+                await asyncio.sleep(self._settings.registry_refresh_seconds)
+            except Exception as e:
+                logger.warning(f"The change stream of the site registry failed, resuming it: {e}")
+                await asyncio.sleep(self._settings.registry_refresh_seconds)
+
+    async def _sync_loop(self) -> None:
+        watcher = asyncio.create_task(self._watch_loop())
+        try:
+            while True:
+                await asyncio.sleep(self._settings.registry_refresh_seconds)
+                # While the change stream is watched, it also reloads all sites.
+                if not watcher.done():
+                    continue
+                try:
+                    if (
+                        not self.ready
+                        or time.monotonic() - self._loaded_at > self._settings.registry_full_reload_seconds
+                    ):
+                        await self.reload()
+                    else:
+                        await self.refresh()
+                except Exception as e:
+                    logger.exception(f"Failed to sync the site registry, keeping the current sites: {e}")
+        finally:
+            watcher.cancel()
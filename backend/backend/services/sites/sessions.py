@@ -0,0 +1,89 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING
+
+from backend.utils.log import logger
+
+from .models import Site, SiteObjects, WidgetSession
+
+if TYPE_CHECKING:
+    from backend.core.settings import WidgetSessionSettings
+
+SIGNATURE_BYTES = 16
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class WidgetSessions:
+    """Short-lived, HMAC-signed widget session tokens, so widget requests can skip the site lookup."""
+
+    def __init__(self, settings: "WidgetSessionSettings"):
+        self._settings = settings
+        self._key = settings.secret.encode() if settings.secret else b""
+        self._revoked: frozenset[tuple[str, str]] = frozenset()
+        self._sites = SiteObjects()
+        self._refresh_task: asyncio.Task[None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._key)
+
+    def issue(self, site: Site, origin: str) -> WidgetSession:
+        expires_at = int(time.time()) + self._settings.ttl_seconds
+        payload = _encode(f"{site.site_id}\n{site.domain}\n{origin}\n{expires_at}".encode())
+        return WidgetSession(
+            token=f"{payload}.{self._sign(payload)}", expires_at=datetime.fromtimestamp(expires_at, UTC)
+        )
+
+    def verify(self, token: str, site_id: str, origin: str) -> Site | None:
+        """The site of a valid token for the site id and origin, or None."""
+        payload, _, signature = token.partition(".")
+        # Compared as bytes, comparing strings raises for non-ASCII characters.
+        if not hmac.compare_digest(signature.encode(), self._sign(payload).encode()):
+            return None
+        try:
+            token_site_id, domain, token_origin, expires_at = _decode(payload).decode().split("\n")
+        except ValueError:
+            return None
+        if token_site_id != site_id or token_origin != origin or int(expires_at) < time.time():
+            return None
+        if (site_id, domain) in self._revoked:
+            return None
+
+        return self._sites.get(site_id, domain)
+
+    async def start(self) -> None:
+        if self.enabled and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    async def refresh_revocations(self) -> None:
+        cursor = Site.get_motor_collection().find(
+            {"active": False}, projection={"site_id": True, "domain": True, "_id": False}
+        )
+        self._revoked = frozenset([(document["site_id"], document["domain"]) async for document in cursor])
+
+    def _sign(self, payload: str) -> str:
+        return _encode(hmac.digest(self._key, payload.encode(), hashlib.sha256)[:SIGNATURE_BYTES])
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await self.refresh_revocations()
+            except Exception as e:
+                logger.exception(f"Failed to refresh the revoked widget sessions, keeping the current list: {e}")
+            await asyncio.sleep(self._settings.revocation_refresh_seconds)
@@ -0,0 +1,183 @@
+import asyncio
+import bisect
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from typing import TYPE_CHECKING, BinaryIO
+
+from backend.utils.log import logger
+
+from .models import Site, SiteObjects
+from .registry import SiteRegistry
+
+if TYPE_CHECKING:
+    from backend.core.settings import SiteVerificationSettings
+
+MAGIC = b"SITEIDX2"
+HEADER = struct.Struct("<8sQ?")  # magic, number of records, written while the registry was watching
+RECORD = struct.Struct("<16s8sB")  # site_id hash, domain hash, active
+KEY_SIZE = 24
+
+
+def record_key(site_id: str, domain: str) -> bytes:
+    """Fixed size key of a site id and domain, records are sorted by it."""
+    return (
+        hashlib.blake2b(site_id.encode(), digest_size=16).digest()
+        + hashlib.blake2b(domain.encode(), digest_size=8).digest()
+    )
+
+
+def write_index(path: str, sites: list[tuple[str, str, bool]], watching: bool) -> None:
+    """Write the sites to a sorted index file, replacing the previous file at once."""
+    # An active site wins over inactive documents with the same site id and domain.
+    records: dict[bytes, bool] = {}
+    for site_id, domain, active in sites:
+        key = record_key(site_id, domain)
+        records[key] = records.get(key, False) or active
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, len(records), watching))
+        file.write(b"".join(RECORD.pack(key[:16], key[16:], active) for key, active in sorted(records.items())))
+    os.replace(temporary_path, path)
+
+
+class _Keys:
+    """The keys of the records in the mapped file, as a sequence for `bisect`."""
+
+    def __init__(self, buffer: mmap.mmap, count: int):
+        self._buffer = buffer
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> bytes:
+        offset = HEADER.size + index * RECORD.size
+        return self._buffer[offset : offset + KEY_SIZE]
+
+
+class SharedSiteIndex:
+    """Site index in a memory-mapped file, written by one worker and shared by all workers of a host."""
+
+    def __init__(self, settings: "SiteVerificationSettings", registry: SiteRegistry):
+        self._settings = settings
+        self._registry = registry
+        self._path = settings.registry_shared_file
+        self._buffer: mmap.mmap | None = None
+        self._keys: _Keys | None = None
+        self._file_id: tuple[int, int] | None = None  # (inode, mtime) of the mapped file
+        self._sites = SiteObjects()  # cleared when the file changes
+        self._next_check = 0.0
+        self._lock_file: BinaryIO | None = None
+        self._watching = False
+        self._written: tuple[int, bool] | None = None  # registry version and watching of the written file
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._settings.registry_enabled and self._path is not None
+
+    @property
+    def ready(self) -> bool:
+        self._check()
+        return self._keys is not None
+
+    @property
+    def watching(self) -> bool:
+        """Whether the file is kept current by a change stream, so a site that is not in it does not exist."""
+        return self.ready and self._watching
+
+    def get(self, site_id: str, domain: str) -> Site | None:
+        """The active site with the id and domain. Only valid when the index is `ready`."""
+        assert self._keys is not None and self._buffer is not None
+        site = self._sites.cached(site_id, domain)
+        if site is not None:
+            return site
+
+        key = record_key(site_id, domain)
+        index = bisect.bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            return None
+        if not self._buffer[HEADER.size + index * RECORD.size + KEY_SIZE]:
+            return None
+        # Only the id and domain are in the index, which is all the widget endpoints need.
+        return self._sites.get(site_id, domain)
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._lock_file is not None:
+            await self._registry.stop()
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _check(self) -> None:
+        """Map the file when it was replaced, at most every `registry_shared_check_seconds`."""
+        now = time.monotonic()
+        if self._path is None or now < self._next_check:
+            return
+        self._next_check = now + self._settings.registry_shared_check_seconds
+
+        try:
+            stat = os.stat(self._path)
+            if (stat.st_ino, stat.st_mtime_ns) == self._file_id:
+                return
+            with open(self._path, "rb") as file:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:  # an empty file cannot be mapped
+            logger.error(f"Failed to map the shared site index {self._path}, keeping the current one: {e}")
+            return
+
+        magic, count, watching = HEADER.unpack_from(buffer) if len(buffer) >= HEADER.size else (None, 0, False)
+        if magic != MAGIC or len(buffer) != HEADER.size + count * RECORD.size:
+            logger.error(f"Invalid shared site index {self._path}, keeping the current one")
+            buffer.close()
+            return
+
+        previous = self._buffer
+        self._buffer, self._keys, self._file_id = buffer, _Keys(buffer, count), (stat.st_ino, stat.st_mtime_ns)
+        self._watching = watching
+        self._sites.clear()
+        if previous is not None:
+            previous.close()
+
+    def _try_lock(self) -> bool:
+        assert self._path is not None
+        lock_file = open(f"{self._path}.lock", "wb")  # noqa: SIM115, closed in stop
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._lock_file is None and self._try_lock():
+                    logger.info(f"Writing the shared site index {self._path} in this worker")
+                    await self._registry.load()
+                if self._lock_file is not None and self._registry.ready:
+                    await self._write()
+            except Exception as e:
+                logger.exception(f"Failed to update the shared site index: {e}")
+            await asyncio.sleep(self._settings.registry_shared_check_seconds)
+
+    async def _write(self) -> None:
+        written = (self._registry.version, self._registry.watching)
+        if written != self._written:
+            assert self._path is not None
+            await asyncio.to_thread(write_index, self._path, self._registry.sites(), written[1])
+            self._written = written
@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+# Add the project root to sys.path to enable absolute imports
+project_root = str(Path(__file__).parent.parent)
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+# Creating a Bedrock client needs a region, but no credentials: nothing is sent to AWS.
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-central-1")
+
+from pydantic_ai import Agent  # noqa: E402
+
+from backend.core.settings import settings  # noqa: E402
+from backend.services.chat.agents import AgentRegistry  # noqa: E402
+
+INSTRUCTIONS = "You are an expert content simplifier. " * 200
+
+
+def per_request_agent() -> Agent:
+    """What process_chat_message used to do for every chat message."""
+    return Agent(settings.chat.model, instructions=INSTRUCTIONS)
+
+
+def benchmark(iterations: int) -> None:
+    registry = AgentRegistry(settings.chat.agents)
+    registry.get(settings.chat.model, INSTRUCTIONS)  # warm up, the first request pays the setup cost once
+
+    before = timeit.timeit(per_request_agent, number=iterations) / iterations
+    after = timeit.timeit(lambda: registry.get(settings.chat.model, INSTRUCTIONS), number=iterations) / iterations
+
+    print(f"model: {settings.chat.model}, iterations: {iterations}")
+    print(f"per request agent:  {before * 1e6:10.1f} us/request")
+    print(f"agent registry:     {after * 1e6:10.1f} us/request")
+    print(f"speedup:            {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request agent setup cost, before and after the agent registry")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    benchmark(args.iterations)